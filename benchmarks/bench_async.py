@@ -0,0 +1,122 @@
+# --------------------------------------------------------------
+# Sync loop vs. async pipeline, against local stand-in servers
+#  -    runs the same weather questions through the blocking flow from
+#       openai_function_calling.py (its turn(), one question at a time) and
+#       through openai_async_function_calling.answer() (many at once on one
+#       event loop)
+#  -    SETTINGS make the sync turn do what the async one does: ask gpt-4o for
+#       the tools and the answer, with no local city lookup, guessing, streaming
+#       or caches, and neither client retries on its own
+#  -    run from the repository root:
+#           python -m benchmarks.bench_async --conversations 200 --concurrency 100
+# --------------------------------------------------------------
+
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import time
+
+import openai
+
+import forecast
+import openai_async_function_calling as async_flow
+import openai_function_calling
+from benchmarks.stand_in_servers import StandInServers
+
+# Set in main(), not on import: bench_flows.py and bench_memory.py import the questions from here.
+SETTINGS = {
+    "FORECAST_CACHE_TTL": "0",
+    "COMPLETION_CACHE": "0",
+    "FAST_ANSWERS": "0",
+    "USE_GAZETTEER": "0",
+    "SPECULATE": "0",
+    "PREWARM": "0",
+    "STREAM_RESPONSES": "0",
+    "STREAM_TOOL_CALLS": "0",
+    "TOOL_MODEL": "gpt-4o",
+    "ESCALATION_MODEL": "gpt-4o",
+    "ANSWER_MODEL": "gpt-4o",
+}
+
+CITIES = ["Chicago", "Boston", "Los Angeles", "New York", "Philadelphia"]
+WANTS = ["temperature", "wind speed", "temperature and wind speed"]
+
+
+def questions(n):
+    return [(CITIES[i % len(CITIES)], WANTS[i % len(WANTS)]) for i in range(n)]
+
+
+def sync_turn(client, city, what_they_want):
+    forecast.start_turn()
+    return openai_function_calling.turn(client, city, what_they_want, out=io.StringIO())
+
+
+def run_sync(base_url, jobs):
+    client = openai.OpenAI(base_url=base_url, api_key="stand-in", max_retries=0)
+    latencies = []
+    start = time.perf_counter()
+    for city, what_they_want in jobs:
+        t = time.perf_counter()
+        sync_turn(client, city, what_they_want)
+        latencies.append(time.perf_counter() - t)
+    return time.perf_counter() - start, latencies
+
+
+async def run_async(base_url, jobs, concurrency):
+    client = openai.AsyncOpenAI(base_url=base_url, api_key="stand-in", max_retries=0)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(city, what_they_want):
+        async with semaphore:
+            t = time.perf_counter()
+            await async_flow.answer(client, http, city, what_they_want)
+            latencies.append(time.perf_counter() - t)
+
+    async with async_flow.make_http_client() as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(city, what_they_want) for city, what_they_want in jobs))
+        elapsed = time.perf_counter() - start
+    await client.close()
+    return elapsed, latencies
+
+
+def report(label, elapsed, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{label:>6}: {len(latencies)} turns in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.1f} turns/s), "
+          f"p50 {statistics.median(latencies) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--sync-conversations", type=int, default=20,
+                        help="the sync loop is slow, so by default it only runs a sample and extrapolates")
+    parser.add_argument("--openai-latency", type=float, default=0.2)
+    parser.add_argument("--forecast-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    os.environ.update(SETTINGS)
+
+    with StandInServers(args.openai_latency, args.forecast_latency) as servers:
+        forecast.FORECAST_URL = servers.forecast_url
+
+        sync_elapsed, sync_latencies = run_sync(servers.base_url, questions(args.sync_conversations))
+        report("sync", sync_elapsed, sync_latencies)
+
+        async_elapsed, async_latencies = asyncio.run(
+            run_async(servers.base_url, questions(args.conversations), args.concurrency))
+        report("async", async_elapsed, async_latencies)
+
+    sync_rate = len(sync_latencies) / sync_elapsed
+    async_rate = len(async_latencies) / async_elapsed
+    print(f"speedup: {async_rate / sync_rate:.1f}x throughput at concurrency {args.concurrency}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# --------------------------------------------------------------
+# Reproducible benchmark of the three scripts, against local stand-in servers
+#  -    runs the turn from openai_simple_chat.py, openai_simple_function_calling.py
+#       and openai_function_calling.py (minus input() and print()) over the
+#       same fixed list of questions; openai_function_calling.py's once more
+#       with STREAM_TOOL_CALLS=1 and once with PREWARM=1 (function_calling_stream
+#       and function_calling_prewarm), from --concurrency threads at once, with
+#       the stand-in OpenAI and Open-Meteo servers answering after fixed delays.
+#       The servers run in a separate process, so they don't compete with the
+#       flows for the GIL.
+#  -    each flow is run --repeat times and the median of each number is kept,
+#       which smooths out most of the noise from whatever else the machine is doing
+#  -    for each flow it reports throughput, p50/p95/p99 latency, the peak
+#       memory Python allocated (tracemalloc, measured in a second, untimed
+#       pass since tracing slows everything down) and the process' max RSS
+#  -    --save writes the results to a JSON file; --compare reads one back and
+#       fails (exit code 1) if a flow got slower or bigger by more than --tolerance
+#  -    run from the repository root:
+#           python -m benchmarks.bench_flows --turns 200 --concurrency 16 --save baseline.json
+#           python -m benchmarks.bench_flows --turns 200 --concurrency 16 --compare baseline.json
+# --------------------------------------------------------------
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+# Settings that change what a turn does. Pinned before anything reads them, so two runs
+# measure the same work: no forecast or completion cache, no template answers.
+PINNED_SETTINGS = {
+    "FORECAST_CACHE_TTL": "0",
+    "COMPLETION_CACHE": "0",
+    "FAST_ANSWERS": "0",
+    "STREAM_RESPONSES": "1",
+    "USE_GAZETTEER": "1",
+    "SPECULATE": "1",
+    "TOOL_MODEL": "gpt-4o-mini",
+    "ESCALATION_MODEL": "gpt-4o",
+    "ANSWER_MODEL": "gpt-4o",
+    "STREAM_TOOL_CALLS": "0",
+    "PREWARM": "0",
+}
+os.environ.update(PINNED_SETTINGS)
+
+# Flows that run another flow's turn with some of the settings above changed, while they run.
+FLOW_SETTINGS = {
+    "function_calling_stream": {"STREAM_TOOL_CALLS": "1"},
+    "function_calling_prewarm": {"PREWARM": "1"},
+}
+
+import openai
+
+import forecast
+import gazetteer
+import model_routing
+import openai_function_calling
+import openai_simple_chat
+import openai_simple_function_calling
+import prewarm
+from benchmarks.bench_async import CITIES, WANTS
+from benchmarks.stand_in_servers import StandInServers
+from message_records import compact, tool_result
+from streaming import stream_completion
+
+# Lower is better for all of these; --compare checks each one (and throughput, where higher is
+# better). p99 is reported but not compared: with a few hundred turns it is a handful of samples.
+COMPARED = ["p50_ms", "p95_ms", "peak_python_kb"]
+
+
+# The turns below use the scripts' own tools and prompts, so the benchmark can't drift from them.
+def simple_chat_turn(client, city, what_they_want):
+    messages = [
+        {"role": "system", "content": openai_simple_chat.SYSTEM_PROMPT},
+        {"role": "user", "content": f"Tell me about the {what_they_want} in {city}."},
+    ]
+    return stream_completion(client, out=io.StringIO(), stage="chat", model="gpt-4o-mini", messages=messages).content
+
+
+def simple_function_calling_turn(client, city, what_they_want):
+    messages = [{"role": "user", "content": f"What's the weather like in {city} today?"}]
+    forecast.start_turn()
+    tools = openai_simple_function_calling.tools
+    assistant_message, tool_calls, _ = model_routing.select_tools(
+        client, openai_simple_function_calling.registry, messages, n=1)
+    tool_call = tool_calls[0]
+    result = openai_simple_function_calling.registry.call(tool_call.function.name,
+                                                          json.loads(tool_call.function.arguments))
+    messages.append(compact(assistant_message))
+    messages.append(tool_result(tool_call.id, str(result)))
+    completion_2 = model_routing.create(client, "answer", model_routing.answer_model(), messages=messages, tools=tools)
+    return completion_2.choices[0].message.content
+
+
+def function_calling_turn(client, city, what_they_want):
+    # What main() does between the two input() calls, then the turn itself.
+    forecast.start_turn()
+    early = prewarm.look_up(city)
+    return openai_function_calling.turn(client, city, what_they_want, early, out=io.StringIO())
+
+
+FLOWS = {
+    "simple_chat": simple_chat_turn,
+    "simple_function_calling": simple_function_calling_turn,
+    "function_calling": function_calling_turn,
+    "function_calling_stream": function_calling_turn,
+    "function_calling_prewarm": function_calling_turn,
+}
+
+
+def questions(n):
+    # Half the cities are ones the gazetteer can't settle (unknown or ambiguous), so
+    # function_calling goes through both of its paths.
+    cities = CITIES + ["Springfield", "Atlantis", "Gotham", "Rivendell", "Zion"]
+    return [(cities[i % len(cities)], WANTS[i % len(WANTS)]) for i in range(n)]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_turns(turn, client, jobs, concurrency):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(job):
+        started = time.perf_counter()
+        turn(client, *job)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # list() so an exception in any turn is raised here instead of being dropped.
+        list(pool.map(one, jobs))
+    return latencies
+
+
+def run_flow(turn, client, jobs, concurrency, repeat):
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        latencies = run_turns(turn, client, jobs, concurrency)
+        elapsed = time.perf_counter() - started
+        runs.append((elapsed, [percentile(latencies, p) for p in (0.50, 0.95, 0.99)]))
+    elapsed = statistics.median(elapsed for elapsed, _ in runs)
+    p50, p95, p99 = (statistics.median(run[1][i] for run in runs) for i in range(3))
+
+    tracemalloc.start()
+    run_turns(turn, client, jobs[:100], concurrency)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "turns": len(jobs),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(jobs) / elapsed, 2),
+        "p50_ms": round(p50 * 1000, 1),
+        "p95_ms": round(p95 * 1000, 1),
+        "p99_ms": round(p99 * 1000, 1),
+        "peak_python_kb": peak // 1024,
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1),
+    }
+
+
+def serve(latencies, urls):
+    # Runs in the child process.
+    servers = StandInServers(*latencies)
+    urls.put((servers.base_url, servers.forecast_url))
+    servers._server.serve_forever()
+
+
+def start_servers(*latencies):
+    # Returns the server process and its (base_url, forecast_url).
+    urls = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(latencies, urls), daemon=True)
+    process.start()
+    return process, urls.get(timeout=30)
+
+
+def report(name, result):
+    print(f"{name:>24}: {result['turns']} turns in {result['seconds']:.2f}s ({result['throughput']:.1f} turns/s), "
+          f"p50 {result['p50_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms, p99 {result['p99_ms']:.0f} ms, "
+          f"peak {result['peak_python_kb']} KiB, max RSS {result['max_rss_kb']} KiB")
+
+
+def compare(baseline, results, tolerance):
+    # Returns the list of regressions, printing every comparison on the way.
+    if baseline.get("config") != results["config"]:
+        print(f"warning: baseline was run with {baseline.get('config')}, this run with {results['config']}")
+
+    regressions = []
+    for name, result in results["flows"].items():
+        before = baseline.get("flows", {}).get(name)
+        if before is None:
+            continue
+        changes = []
+        for metric in COMPARED + ["throughput"]:
+            old, new = before[metric], result[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            # Throughput is the one metric where higher is better.
+            worse = -change if metric == "throughput" else change
+            changes.append(f"{metric} {change:+.0%}")
+            if worse > tolerance:
+                regressions.append(f"{name} {metric}: {old} -> {new}")
+        print(f"{name:>24}: " + ", ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat and function calling flows.")
+    parser.add_argument("--flows", nargs="+", choices=list(FLOWS), default=list(FLOWS))
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per flow; the median of each number is kept")
+    parser.add_argument("--openai-latency", type=float, default=0.2)
+    parser.add_argument("--forecast-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--save", metavar="PATH", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="how much worse (as a fraction) a metric may get before --compare fails")
+    args = parser.parse_args()
+
+    config = {
+        "turns": args.turns,
+        "concurrency": args.concurrency,
+        "repeat": args.repeat,
+        "openai_latency": args.openai_latency,
+        "forecast_latency": args.forecast_latency,
+        "token_latency": args.token_latency,
+    }
+    results = {
+        "config": config,
+        "settings": PINNED_SETTINGS,
+        "flow_settings": FLOW_SETTINGS,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "flows": {},
+    }
+
+    # Build the gazetteer index before timing anything.
+    gazetteer.resolve("Chicago")
+    process, (base_url, forecast_url) = start_servers(args.openai_latency, args.forecast_latency, args.token_latency)
+    try:
+        forecast.FORECAST_URL = forecast_url
+        client = openai.OpenAI(base_url=base_url, api_key="stand-in", max_retries=0)
+        jobs = questions(args.turns)
+        for name in args.flows:
+            os.environ.update(PINNED_SETTINGS)
+            os.environ.update(FLOW_SETTINGS.get(name, {}))
+            # One untimed turn first, so connection setup and imports aren't counted.
+            FLOWS[name](client, *questions(1)[0])
+            results["flows"][name] = run_flow(FLOWS[name], client, jobs, args.concurrency, args.repeat)
+            report(name, results["flows"][name])
+    finally:
+        process.terminate()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f"regressions beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
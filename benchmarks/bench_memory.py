@@ -0,0 +1,96 @@
+# --------------------------------------------------------------
+# How much memory does a conversation take while it is kept around?
+#  -    builds --sessions conversations of --turns weather questions each, the
+#       way a long-running process would hold them, and reports the bytes per
+#       session Python allocated for them (tracemalloc):
+#           before  the OpenAI library's ChatCompletionMessage for every
+#                   assistant message, and a dict for every other message
+#           after   compact Message records (see message_records.py)
+#  -    the responses come from the stand-in server's chat_completion() and are
+#       parsed from JSON text for every session, like responses off the wire,
+#       so no strings are shared between sessions that wouldn't be for real.
+#  -    run from the repository root:
+#           python -m benchmarks.bench_memory --sessions 2000 --turns 5
+# --------------------------------------------------------------
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+from openai.types.chat import ChatCompletion
+
+from benchmarks.bench_async import CITIES, WANTS
+from benchmarks.stand_in_servers import chat_completion
+from message_records import compact, tool_result
+
+
+def responses(question, tools):
+    # The two responses of a turn, as the JSON text OpenAI would send.
+    messages = [{"role": "user", "content": question}]
+    selection = chat_completion({"messages": messages, "tools": tools})
+    messages.append(selection["choices"][0]["message"])
+    for tool_call in selection["choices"][0]["message"]["tool_calls"]:
+        messages.append({"role": "tool", "tool_call_id": tool_call["id"], "content": "21.5"})
+    return json.dumps(selection), json.dumps(chat_completion({"messages": messages}))
+
+
+def session_before(turns):
+    messages = []
+    for question, (selection, answer) in turns:
+        messages.append({"role": "user", "content": question})
+        message = ChatCompletion.model_validate(json.loads(selection)).choices[0].message
+        messages.append(message)
+        for tool_call in message.tool_calls:
+            messages.append({"role": "tool", "tool_call_id": tool_call.id, "content": str(21.5)})
+        messages.append(ChatCompletion.model_validate(json.loads(answer)).choices[0].message)
+    return messages
+
+
+def session_after(turns):
+    messages = []
+    for question, (selection, answer) in turns:
+        messages.append(compact({"role": "user", "content": question}))
+        message = ChatCompletion.model_validate(json.loads(selection)).choices[0].message
+        messages.append(compact(message))
+        for tool_call in message.tool_calls:
+            messages.append(tool_result(tool_call.id, str(21.5)))
+        messages.append(compact(ChatCompletion.model_validate(json.loads(answer)).choices[0].message))
+    return messages
+
+
+def bytes_per_session(build, sessions, turns):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # Questions are built per session (the f-string makes a new string every time), like user input.
+    kept = [build([(f"What's the {want} like in {city} today?", texts) for city, want, texts in turns])
+                   for _ in range(sessions)]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory each kept conversation takes.")
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=5)
+    args = parser.parse_args()
+
+    tools = [{"type": "function", "function": {"name": "get_weather"}}]
+    turns = []
+    for i in range(args.turns):
+        city, want = CITIES[i % len(CITIES)], WANTS[i % len(WANTS)]
+        turns.append((city, want, responses(f"What's the {want} like in {city} today?", tools)))
+
+    before = bytes_per_session(session_before, args.sessions, turns)
+    after = bytes_per_session(session_after, args.sessions, turns)
+    print(f"{args.sessions} sessions of {args.turns} turns each")
+    print(f"{'before':>8}: {before:9.0f} bytes per session")
+    print(f"{'after':>8}: {after:9.0f} bytes per session ({after / before - 1:+.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# --------------------------------------------------------------
+# First-byte latency after a pause: cold connections vs. prewarm.py
+#  -    each turn waits --think seconds first, like the scripts do while
+#       someone types at the input() prompt, and then times:
+#           openai      a streamed completion, up to its first token
+#           forecast    one Open-Meteo request through http_transport.py
+#  -    the stand-in servers take --connect-latency for every new connection
+#       (standing in for DNS, TCP and TLS) and close connections left idle for
+#       --idle-timeout seconds. The OpenAI client drops its own after 5.
+#           cold        nothing happens during the pause
+#           warm        the pause runs inside prewarm.while_waiting()
+#  -    reports the p50 / max of each, and how many connections were opened
+#  -    run from the repository root:
+#           python -m benchmarks.bench_prewarm --turns 5 --think 6
+# --------------------------------------------------------------
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import time
+
+os.environ.update({"PREWARM": "1", "COMPLETION_CACHE": "0"})
+
+import openai
+
+import forecast
+import http_transport
+import prewarm
+from benchmarks.stand_in_servers import StandInServers
+from streaming import stream_completion
+
+
+def turn(client):
+    answer = stream_completion(client, out=io.StringIO(), model="gpt-4o-mini",
+                               messages=[{"role": "user", "content": "Say hello."}])
+    started = time.perf_counter()
+    http_transport.get(forecast.FORECAST_URL, params=forecast.forecast_params([(41.85, -87.65)]))
+    return answer.time_to_first_token, time.perf_counter() - started
+
+
+def run(name, args, warm):
+    with StandInServers(args.openai_latency, args.forecast_latency, connect_latency=args.connect_latency,
+                        idle_timeout=args.idle_timeout) as servers:
+        forecast.FORECAST_URL = servers.forecast_url
+        client = openai.OpenAI(base_url=servers.base_url, api_key="stand-in")
+        # A first, untimed turn, so both runs start from connections that have been used once.
+        turn(client)
+
+        openai_seconds, forecast_seconds = [], []
+        for _ in range(args.turns):
+            with prewarm.while_waiting(lambda: client) if warm else contextlib.nullcontext():
+                time.sleep(args.think)
+            first_token, forecast_request = turn(client)
+            openai_seconds.append(first_token)
+            forecast_seconds.append(forecast_request)
+        connections = servers.requests["connections"]
+
+    print(f"{name:>5}: openai first token p50 {statistics.median(openai_seconds) * 1000:5.0f} ms "
+          f"(max {max(openai_seconds) * 1000:4.0f}), forecast p50 {statistics.median(forecast_seconds) * 1000:5.0f} ms "
+          f"(max {max(forecast_seconds) * 1000:4.0f}), {connections} connections opened")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare first-byte latency after a pause, with and without prewarm.")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--think", type=float, default=6.0, help="seconds spent at the prompt before each turn")
+    parser.add_argument("--connect-latency", type=float, default=0.1)
+    parser.add_argument("--idle-timeout", type=float, default=5.0)
+    parser.add_argument("--openai-latency", type=float, default=0.05)
+    parser.add_argument("--forecast-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    # Each run gets its own servers and client, so the second doesn't start with the first's connections.
+    run("cold", args, warm=False)
+    run("warm", args, warm=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# --------------------------------------------------------------
+# Rate limits: no pacing vs. the scheduler in rate_limit.py
+#  -    runs the same burst of completions against the stand-in server with
+#       its requests/tokens per minute limits switched on, from --concurrency
+#       threads at once:
+#           unpaced     client.chat.completions.create() with the OpenAI
+#                       library's own retries (2, as it comes)
+#           scheduled   rate_limit.create(), which paces, adapts and retries
+#  -    for each it reports how many completions made it, how many 429s the
+#       server answered, and how long the burst took
+#  -    then a third run mixes interactive and batch requests through the
+#       scheduler and reports the p50 / p95 latency of each lane
+#  -    run from the repository root:
+#           python -m benchmarks.bench_rate_limit --requests 400 --rpm 300
+# --------------------------------------------------------------
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+import rate_limit
+from benchmarks.stand_in_servers import StandInServers
+
+
+def question(i):
+    return [{"role": "user", "content": f"Tell me a fact about the number {i}."}]
+
+
+def run(name, args, jobs, send):
+    # Every run gets its own stand-in server, so each starts with a full allowance.
+    with StandInServers(args.openai_latency, requests_per_minute=args.rpm, tokens_per_minute=args.tpm) as servers:
+        client = openai.OpenAI(base_url=servers.base_url, api_key="stand-in")
+        latencies = {}
+        failed = 0
+        lock = threading.Lock()
+
+        def one(job):
+            nonlocal failed
+            i, lane = job
+            started = time.perf_counter()
+            try:
+                send(client, i, lane)
+            except openai.APIStatusError:
+                with lock:
+                    failed += 1
+                return
+            with lock:
+                latencies.setdefault(lane, []).append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(one, jobs))
+        elapsed = time.perf_counter() - started
+
+    done = sum(len(values) for values in latencies.values())
+    print(f"{name:>10}: {done} done, {failed} failed, {servers.requests['rate_limited']} 429s "
+          f"in {elapsed:.1f}s ({done / elapsed:.1f}/s)")
+    for lane, values in sorted(latencies.items()):
+        values.sort()
+        print(f"{'':>12}{lane:>11}: p50 {statistics.median(values) * 1000:6.0f} ms, "
+              f"p95 {values[int(len(values) * 0.95)] * 1000:6.0f} ms")
+
+
+def unpaced(client, i, lane):
+    client.chat.completions.create(model="gpt-4o-mini", messages=question(i))
+
+
+def scheduled(client, i, lane):
+    rate_limit.current_lane.set(lane)
+    rate_limit.create(client, "bench", model="gpt-4o-mini", messages=question(i))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare completions with and without the rate limit scheduler.")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rpm", type=int, default=300)
+    parser.add_argument("--tpm", type=int, default=1000000)
+    parser.add_argument("--openai-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    jobs = [(i, "interactive") for i in range(args.requests)]
+    run("unpaced", args, jobs, unpaced)
+
+    # The scheduler learns the limits from the stand-in's headers, starting from scratch each run.
+    rate_limit._scheduler = rate_limit.Scheduler()
+    run("scheduled", args, jobs, scheduled)
+
+    rate_limit._scheduler = rate_limit.Scheduler()
+    run("lanes", args, [(i, "interactive" if i % 4 == 0 else "batch") for i in range(args.requests)], scheduled)
+
+
+if __name__ == "__main__":
+    main()
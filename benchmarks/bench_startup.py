@@ -0,0 +1,64 @@
+# --------------------------------------------------------------
+# How long until each script shows its first prompt?
+#  -    starts each script with python -m, the way you would from a terminal,
+#       and times how long it takes until the first prompt is written. That is
+#       everything a user waits through before they can type: starting Python,
+#       importing modules, loading .env.
+#  -    each script is started --runs times and the median is kept. The time
+#       Python itself takes to start (python -c pass) is shown for comparison,
+#       along with how long importing openai would add if it weren't deferred
+#       until the first question.
+#  -    run from the repository root:
+#           python -m benchmarks.bench_startup
+# --------------------------------------------------------------
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS = [
+    "openai_simple_chat",
+    "openai_simple_function_calling",
+    "openai_function_calling",
+    "openai_async_function_calling",
+]
+
+
+def time_to_prompt(args):
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, *args], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # input() flushes its prompt, so the first byte on stdout means the prompt is up.
+    process.stdout.read(1)
+    elapsed = time.perf_counter() - started
+    process.communicate(b"exit\n")
+    return elapsed
+
+
+def time_to_exit(args):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, *args], check=True)
+    return time.perf_counter() - started
+
+
+def median_ms(measure, args, runs):
+    return statistics.median(measure(args) for _ in range(runs)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time how long each script takes to show its first prompt.")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    baseline = median_ms(time_to_exit, ["-c", "pass"], args.runs)
+    print(f"{'python -c pass':>34}: {baseline:6.1f} ms")
+    for script in SCRIPTS:
+        elapsed = median_ms(time_to_prompt, ["-m", script], args.runs)
+        print(f"{script:>34}: {elapsed:6.1f} ms to the first prompt ({elapsed - baseline:+.1f} ms over Python itself)")
+    deferred = median_ms(time_to_exit, ["-c", "import openai"], args.runs) - baseline
+    print(f"{'(import openai, deferred)':>34}: {deferred:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# --------------------------------------------------------------
+# Tool calls: started after the response vs. started while it streams
+#  -    runs the tool selection request and the tool calls of one turn from
+#       openai_function_calling.py, for questions that need several tool calls
+#       ("... in Boston, New York and Philadelphia today?"), against the
+#       stand-in servers with a delay between streamed chunks:
+#           after       the whole response first, then forecast.prefetch()
+#                       and run_tool_calls(), like STREAM_TOOL_CALLS=0
+#           streamed    each tool call started as soon as its arguments are
+#                       complete (streaming.stream_tool_calls()), like
+#                       STREAM_TOOL_CALLS=1
+#       Both stream the response: the stand-in only takes --token-latency per
+#       chunk for streamed responses, and a real model takes as long to write
+#       the tool calls either way.
+#  -    reports the p50 / p95 time until every tool message is ready, and
+#       checks that the streamed assistant message is the one a normal
+#       response puts in the history
+#  -    run from the repository root:
+#           python -m benchmarks.bench_stream_tools --turns 20 --token-latency 0.02
+# --------------------------------------------------------------
+
+import argparse
+import os
+import statistics
+import time
+
+os.environ.update({"FORECAST_CACHE_TTL": "0", "COMPLETION_CACHE": "0"})
+
+import openai
+
+import completion_cache
+import forecast
+import openai_function_calling
+from benchmarks.stand_in_servers import StandInServers
+from message_records import compact
+from streaming import stream_tool_calls
+from tool_executor import collect, run_tool_calls, submit
+
+QUESTIONS = [
+    "What's the temperature and wind speed like in Boston, New York and Philadelphia today?",
+    "What's the temperature like in Chicago, Los Angeles and Boston today?",
+    "What's the weather like later in Boston and New York today?",
+]
+
+
+def after(client, messages):
+    message, tool_calls, _ = stream_tool_calls(client, lambda index, tool_call: None, stage="tool_selection",
+                                            model="gpt-4o", messages=messages, tools=openai_function_calling.tools)
+    forecast.prefetch(forecast.tool_call_points(tool_calls))
+    return message, run_tool_calls(tool_calls, openai_function_calling.call_function)
+
+
+def streamed(client, messages):
+    started = {}
+    message, tool_calls, _ = stream_tool_calls(
+        client,
+        lambda index, tool_call: started.__setitem__(index, submit(tool_call, openai_function_calling.call_function)),
+        stage="tool_selection",
+        model="gpt-4o",
+        messages=messages,
+        tools=openai_function_calling.tools,
+    )
+    return message, collect(tool_calls, [started[index] for index in sorted(started)])
+
+
+def run(name, client, turns, flow):
+    latencies = []
+    history = []
+    for i in range(turns):
+        messages = [{"role": "user", "content": QUESTIONS[i % len(QUESTIONS)]}]
+        forecast.start_turn()
+        started = time.perf_counter()
+        message, tool_messages = flow(client, messages)
+        latencies.append(time.perf_counter() - started)
+        history.append((dict(message), [dict(tool_message) for tool_message in tool_messages]))
+    latencies.sort()
+    print(f"{name:>10}: p50 {statistics.median(latencies) * 1000:6.0f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.0f} ms")
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare starting tool calls after vs. while the response streams.")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--openai-latency", type=float, default=0.2)
+    parser.add_argument("--forecast-latency", type=float, default=0.15)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with StandInServers(args.openai_latency, args.forecast_latency, args.token_latency) as servers:
+        forecast.FORECAST_URL = servers.forecast_url
+        client = openai.OpenAI(base_url=servers.base_url, api_key="stand-in")
+        # One untimed turn of each, so neither pays for opening connections.
+        after(client, [{"role": "user", "content": QUESTIONS[0]}])
+        streamed(client, [{"role": "user", "content": QUESTIONS[0]}])
+
+        before = run("after", client, args.turns, after)
+        streamed_history = run("streamed", client, args.turns, streamed)
+
+        # The history a normal response gives, to check the streamed message against.
+        plain = [compact(completion_cache.create(client, "tool_selection", model="gpt-4o", messages=messages,
+                                                 tools=openai_function_calling.tools).choices[0].message)
+                 for messages in ([{"role": "user", "content": question}] for question in QUESTIONS)]
+
+    # Tool call ids and results are the same for the same question, so the histories must match.
+    print("same tool messages:", [tools for _, tools in before] == [tools for _, tools in streamed_history])
+    print("same assistant messages as a normal response:",
+          all(message == dict(plain[i % len(QUESTIONS)]) for i, (message, _) in enumerate(streamed_history)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+# --------------------------------------------------------------
+# Local stand-ins for the OpenAI and Open-Meteo APIs
+#  -    the benchmarks can't depend on a real API key or the network, and real
+#       latencies are too noisy to compare runs with anyway. StandInServers
+#       answers the two endpoints our scripts use with canned responses after
+#       a configurable delay:
+#           POST /v1/chat/completions   tool calls for the first completion,
+#                                       a short answer once tool results are in
+#                                       (streamed as server-sent events when
+#                                       the request says "stream": true)
+#           GET  /v1/forecast           a "current" block for any coordinates
+#                                       (a list of them for comma-separated
+#                                       coordinates, like the real API), and
+#                                       an "hourly" block when asked for one
+#  -    with requests_per_minute / tokens_per_minute set, the completions
+#       endpoint also enforces OpenAI-style rate limits: every response carries
+#       the x-ratelimit-* headers, and a request over the limit gets a 429 with
+#       retry-after instead of an answer.
+#  -    connect_latency is slept once per new connection, standing in for the
+#       TCP and TLS handshakes of a real server, and with idle_timeout set,
+#       keep-alive connections idle for that long are closed, like real
+#       servers do. GET /v1/models and HEAD requests are answered too, so the
+#       connections can be kept warm (see prewarm.py).
+#  -    point the OpenAI client at base_url (or set OPENAI_BASE_URL) and
+#       forecast.FORECAST_URL at forecast_url.
+# --------------------------------------------------------------
+
+import json
+import math
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# A few cities the canned tool calls know the coordinates of. Anything else gets
+# made-up (but stable) coordinates derived from its name.
+CITIES = {
+    "chicago": (41.8781, -87.6298),
+    "boston": (42.3601, -71.0589),
+    "los angeles": (34.0522, -118.2437),
+    "new york": (40.7128, -74.0060),
+    "philadelphia": (39.9526, -75.1652),
+}
+
+
+def coordinates_for(city):
+    city = city.strip().lower()
+    if city in CITIES:
+        return CITIES[city]
+    h = zlib.crc32(city.encode())
+    return (round((h % 18000) / 100 - 90, 4), round((h // 18000 % 36000) / 100 - 180, 4))
+
+
+def _cities_from_question(question):
+    # Questions look like "What's the temperature like in Chicago today?", or
+    # "... in Boston, New York and Philadelphia today?" for several cities.
+    if " in " in question:
+        question = question.rsplit(" in ", 1)[1].removesuffix(" today?")
+    return [city for city in re.split(r",\s*|\s+and\s+", question) if city.strip()] or [question]
+
+
+def _tool_calls_for(question):
+    cities = _cities_from_question(question)
+    question = question.lower()
+    names = []
+    if any(word in question for word in ("later", "afternoon", "evening", "tomorrow")):
+        names.append("get_forecast_summary")
+    else:
+        if "temperature" in question or "weather" in question:
+            names.append("get_weather")
+        if "wind" in question:
+            names.append("get_wind_speed")
+    calls = []
+    for city in cities:
+        latitude, longitude = coordinates_for(city)
+        for name in names or ["get_weather"]:
+            arguments = {"latitude": latitude, "longitude": longitude}
+            if name == "get_forecast_summary":
+                arguments["days"] = 2
+            calls.append({
+                "id": f"call_{len(calls)}_{zlib.crc32(question.encode()):08x}",
+                "type": "function",
+                "function": {"name": name, "arguments": json.dumps(arguments)},
+            })
+    return calls
+
+
+def chat_completion(body):
+    messages = body.get("messages", [])
+    last = messages[-1] if messages else {}
+    message = {"role": "assistant", "content": None}
+    if body.get("tools") and last.get("role") == "user":
+        message["tool_calls"] = _tool_calls_for(last.get("content") or "")
+        finish_reason = "tool_calls"
+    else:
+        results = [m.get("content") for m in messages if m.get("role") == "tool"]
+        if results:
+            message["content"] = "Right now it is " + " and ".join(results) + ". Have a nice day!"
+        else:
+            message["content"] = "This is a canned answer from the stand-in server."
+        finish_reason = "stop"
+
+    prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4 + 10
+    completion_tokens = len(message["content"] or "") // 4 + 10
+    return {
+        "id": "chatcmpl-stand-in",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def chat_completion_chunks(response, include_usage=False):
+    # Split a finished response into the chunks a streaming request would get:
+    # the answer a few words at a time, tool call arguments a few characters at a time.
+    message = response["choices"][0]["message"]
+
+    def chunk(delta, finish_reason=None):
+        return {
+            "id": response["id"],
+            "object": "chat.completion.chunk",
+            "created": response["created"],
+            "model": response["model"],
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}],
+        }
+
+    yield chunk({"role": "assistant", "content": ""})
+    words = (message["content"] or "").split(" ")
+    for i in range(0, len(words), 2):
+        text = " ".join(words[i:i + 2])
+        yield chunk({"content": text if i == 0 else " " + text})
+    for index, tool_call in enumerate(message.get("tool_calls") or []):
+        yield chunk({"tool_calls": [{
+            "index": index,
+            "id": tool_call["id"],
+            "type": "function",
+            "function": {"name": tool_call["function"]["name"], "arguments": ""},
+        }]})
+        arguments = tool_call["function"]["arguments"]
+        for i in range(0, len(arguments), 8):
+            yield chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[i:i + 8]}}]})
+    yield chunk({}, response["choices"][0]["finish_reason"])
+    if include_usage:
+        yield {**chunk({}), "choices": [], "usage": response["usage"]}
+
+
+def forecast_response(query):
+    latitudes = query.get("latitude", ["0"])[0].split(",")
+    longitudes = query.get("longitude", ["0"])[0].split(",")
+    days = int(query["forecast_days"][0]) if "forecast_days" in query else (7 if "hourly" in query else 0)
+    locations = [_location(float(latitude), float(longitude), days)
+                 for latitude, longitude in zip(latitudes, longitudes)]
+    # One location comes back as an object, several as a list.
+    return locations[0] if len(locations) == 1 else locations
+
+
+class _Limit:
+    # A bucket of per_minute requests or tokens that refills continuously, like OpenAI's.
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def shortfall(self, amount):
+        # Seconds until amount is available, 0 if it is now.
+        return max(0.0, (amount - self.level) * 60 / self.per_minute)
+
+    def headers(self, kind):
+        return {
+            f"x-ratelimit-limit-{kind}": str(self.per_minute),
+            f"x-ratelimit-remaining-{kind}": str(int(self.level)),
+            f"x-ratelimit-reset-{kind}": f"{(self.per_minute - self.level) * 60 / self.per_minute:.3f}s",
+        }
+
+
+def _location(latitude, longitude, days=0):
+    # Stable, plausible-looking numbers so repeated runs give identical answers.
+    seed = zlib.crc32(f"{latitude:.2f},{longitude:.2f}".encode())
+    location = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "current": {
+            "time": time.strftime("%Y-%m-%dT%H:%M", time.gmtime()),
+            "interval": 900,
+            "temperature_2m": round(seed % 400 / 10 - 5, 1),
+            "wind_speed_10m": round(seed // 400 % 300 / 10, 1),
+        },
+    }
+    if days:
+        # A day-night cycle around the current numbers, from midnight today (UTC), one value per hour.
+        midnight = int(time.time()) // 86400 * 86400
+        hours = range(days * 24)
+        cycle = [math.sin((hour % 24 - 9) / 24 * 2 * math.pi) for hour in hours]
+        location["utc_offset_seconds"] = 0
+        location["hourly"] = {
+            "time": [time.strftime("%Y-%m-%dT%H:%M", time.gmtime(midnight + hour * 3600)) for hour in hours],
+            "temperature_2m": [round(location["current"]["temperature_2m"] + 5 * c, 1) for c in cycle],
+            "relative_humidity_2m": [round(70 - 20 * c) for c in cycle],
+            "wind_speed_10m": [round(location["current"]["wind_speed_10m"] * (1 + 0.5 * c), 1) for c in cycle],
+        }
+    return location
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep their connections alive between requests.
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # Runs once per connection, before its first request.
+        stand_in = self.server.stand_in
+        stand_in.hit("connections")
+        time.sleep(stand_in.connect_latency)
+        # A connection that waits longer than this for its next request is closed.
+        self.timeout = stand_in.idle_timeout
+        super().setup()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if urlparse(self.path).path.rstrip("/").endswith("/chat/completions"):
+            self.server.stand_in.hit("chat.completions")
+            headers, wait = self.server.stand_in.take(body)
+            if wait:
+                self.server.stand_in.hit("rate_limited")
+                headers.update({"retry-after": str(math.ceil(wait)), "retry-after-ms": str(math.ceil(wait * 1000))})
+                self._send_json(429, {"error": {"message": "Rate limit reached (stand-in).", "type": "requests",
+                                                "code": "rate_limit_exceeded"}}, headers)
+                return
+            time.sleep(self.server.stand_in.openai_latency)
+            if body.get("stream"):
+                include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+                self._send_stream(chat_completion_chunks(chat_completion(body), include_usage), headers)
+            else:
+                self._send_json(200, chat_completion(body), headers)
+        else:
+            self._send_json(404, {"error": {"message": f"no stand-in for {self.path}"}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/").endswith("/models"):
+            self.server.stand_in.hit("models")
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "stand-in"}
+                for model in ("gpt-4o", "gpt-4o-mini")
+            ]})
+        elif url.path.rstrip("/").endswith("/forecast"):
+            self.server.stand_in.hit("forecast")
+            time.sleep(self.server.stand_in.forecast_latency)
+            self._send_json(200, forecast_response(parse_qs(url.query)))
+        else:
+            self._send_json(404, {"error": f"no stand-in for {self.path}"})
+
+    def do_HEAD(self):
+        self.server.stand_in.hit("head")
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, chunks, headers=None):
+        self.send_response(200)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [f"data: {json.dumps(chunk)}\n\n" for chunk in chunks] + ["data: [DONE]\n\n"]
+        for i, event in enumerate(events):
+            if i and self.server.stand_in.token_latency:
+                time.sleep(self.server.stand_in.token_latency)
+            data = event.encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections as soon as a benchmark opens a few hundred at once.
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients closing their pooled connections at exit isn't worth a traceback.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandInServers:
+    def __init__(self, openai_latency=0.0, forecast_latency=0.0, token_latency=0.0, host="127.0.0.1", port=0,
+                 requests_per_minute=None, tokens_per_minute=None, connect_latency=0.0, idle_timeout=None):
+        self.openai_latency = openai_latency
+        self.forecast_latency = forecast_latency
+        # Delay between chunks of a streamed response.
+        self.token_latency = token_latency
+        self.connect_latency = connect_latency
+        self.idle_timeout = idle_timeout
+        self.limits = {}
+        if requests_per_minute:
+            self.limits["requests"] = _Limit(requests_per_minute)
+        if tokens_per_minute:
+            self.limits["tokens"] = _Limit(tokens_per_minute)
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.stand_in = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    @property
+    def forecast_url(self):
+        return f"{self.url}/v1/forecast"
+
+    def hit(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def take(self, body):
+        # Counts a completion request against the limits. Returns the x-ratelimit-* headers
+        # and, if the request is over a limit, how many seconds until it wouldn't be.
+        # Like OpenAI, the tokens counted are the prompt's plus max_tokens.
+        if not self.limits:
+            return {}, 0.0
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in body.get("messages", [])) // 4 + 10
+        amounts = {"requests": 1, "tokens": prompt_tokens + (body.get("max_tokens") or 0)}
+        with self._lock:
+            for limit in self.limits.values():
+                limit.refill()
+            wait = max(limit.shortfall(amounts[kind]) for kind, limit in self.limits.items())
+            if not wait:
+                for kind, limit in self.limits.items():
+                    limit.level -= amounts[kind]
+            headers = {}
+            for kind, limit in self.limits.items():
+                headers.update(limit.headers(kind))
+        return headers, wait
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stand-in-servers", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve stand-in OpenAI and Open-Meteo endpoints.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--forecast-latency", type=float, default=0.1)
+    parser.add_argument("--token-latency", type=float, default=0.02)
+    parser.add_argument("--rpm", type=int, help="requests per minute before answering 429")
+    parser.add_argument("--tpm", type=int, help="tokens per minute before answering 429")
+    parser.add_argument("--connect-latency", type=float, default=0.0)
+    parser.add_argument("--idle-timeout", type=float, help="seconds before an idle connection is closed")
+    args = parser.parse_args()
+
+    servers = StandInServers(args.openai_latency, args.forecast_latency, args.token_latency, port=args.port,
+                             requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+                             connect_latency=args.connect_latency, idle_timeout=args.idle_timeout)
+    print(f"OPENAI_BASE_URL={servers.base_url}")
+    print(f"forecast URL: {servers.forecast_url}")
+    servers._server.serve_forever()
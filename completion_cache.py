@@ -0,0 +1,234 @@
+# --------------------------------------------------------------
+# Cache for OpenAI completions
+#  -    people ask the same things over and over ("What's the temperature and
+#       wind speed like in Chicago today?" comes out of the f-string in
+#       openai_function_calling.py word for word), and every one of them is a
+#       paid request that takes seconds. create() below looks the request up
+#       first and only calls OpenAI when it has no fresh answer.
+#  -    the key is a hash of the model, the messages and the tools, written out
+#       the same way every time: keys sorted, empty fields dropped, extra
+#       whitespace squashed, and tool call ids (which OpenAI makes up fresh
+#       for every response) replaced by their position.
+#  -    each stage keeps its answers for a different time: picking tools for
+#       a question can be reused for a day, but an answer that quotes the live
+#       weather only for a few minutes.
+#  -    recent entries live in memory (least recently used dropped first), and
+#       with COMPLETION_CACHE_PATH set everything is also stored in SQLite so
+#       the cache survives restarts.
+#  -    create() and acreate() also time every real request and record its
+#       token usage in metrics.py, whether the cache is on or not, and send it
+#       through the rate limit scheduler (see rate_limit.py).
+#  -    turned on with COMPLETION_CACHE=1. stats() reports the hit rate and how
+#       many bytes of requests and responses we didn't have to send or receive.
+# --------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import rate_limit
+from metrics import metrics
+
+
+# How long (in seconds) an answer from each stage stays fresh.
+DEFAULT_TTLS = {
+    "tool_selection": 24 * 60 * 60,
+    "answer": 5 * 60,
+    "chat": 60 * 60,
+}
+
+
+def _plain(value):
+    # Turn the OpenAI library's message objects (and our own, see message_records.py) into
+    # plain dicts, without the empty fields.
+    if hasattr(value, "model_dump"):
+        value = value.model_dump(exclude_none=True)
+    if isinstance(value, Mapping):
+        return {k: _plain(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    return value
+
+
+def canonical_messages(messages):
+    messages = _plain(messages)
+    ids = {}
+    for message in messages:
+        for tool_call in message.get("tool_calls") or []:
+            tool_call["id"] = ids.setdefault(tool_call["id"], f"call_{len(ids)}")
+    for message in messages:
+        if "tool_call_id" in message:
+            message["tool_call_id"] = ids.get(message["tool_call_id"], message["tool_call_id"])
+    return messages
+
+
+def request_key(model, messages, tools=None, **params):
+    params.pop("stream", None)
+    params.pop("stream_options", None)
+    request = {"model": model, "messages": canonical_messages(messages), "tools": _plain(tools), **_plain(params)}
+    data = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest(), len(data)
+
+
+class CompletionCache:
+    def __init__(self, max_entries=256, path=None, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            with self._db:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS completions ("
+                    "key TEXT PRIMARY KEY, stage TEXT, stored_at REAL, response TEXT)"
+                )
+
+    def get(self, key, stage, request_size=0):
+        # Returns the cached response JSON, or None.
+        ttl = self.ttls.get(stage, 0)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT stored_at, response FROM completions WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = row
+                    self._remember(key, entry)
+            if entry is None or now - entry[0] > ttl:
+                self.misses += 1
+                metrics.inc("assistant_cache_lookups_total", cache="completion", result="miss", stage=stage)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.inc("assistant_cache_lookups_total", cache="completion", result="hit", stage=stage)
+            self.bytes_saved += request_size + len(entry[1])
+            return entry[1]
+
+    def put(self, key, stage, response):
+        stored_at = time.time()
+        with self._lock:
+            self._remember(key, (stored_at, response))
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                        (key, stage, stored_at, response),
+                    )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "size": len(self._entries),
+            }
+
+    # Callers must hold self._lock. Only the memory tier is trimmed; SQLite keeps
+    # everything until it expires and is overwritten.
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+# Built on first use, so the COMPLETION_CACHE_* settings can come from the .env file.
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    # Returns None when the cache is turned off.
+    global _cache
+    if os.getenv("COMPLETION_CACHE", "0").lower() not in ("1", "true", "yes"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CompletionCache(
+                max_entries=int(os.getenv("COMPLETION_CACHE_SIZE", "256")),
+                path=os.getenv("COMPLETION_CACHE_PATH") or None,
+                ttls={stage: float(os.getenv(f"COMPLETION_CACHE_TTL_{stage.upper()}", ttl))
+                      for stage, ttl in DEFAULT_TTLS.items()},
+            )
+    return _cache
+
+
+def _to_completion(response):
+    from openai.types.chat import ChatCompletion
+    return ChatCompletion.model_validate_json(response)
+
+
+def lookup(stage, **kwargs):
+    # Returns (cached completion or None, key to store the real one under).
+    cache = get_cache()
+    if cache is None:
+        return None, None
+    key, request_size = request_key(**kwargs)
+    response = cache.get(key, stage, request_size)
+    return (_to_completion(response) if response is not None else None), key
+
+
+def store(stage, key, completion):
+    cache = get_cache()
+    if cache is not None and key is not None:
+        cache.put(key, stage, completion.model_dump_json() if hasattr(completion, "model_dump_json") else json.dumps(completion))
+
+
+def create(client, stage, **kwargs):
+    # Drop-in for client.chat.completions.create(**kwargs) that checks the cache first.
+    cached, key = lookup(stage, **kwargs)
+    if cached is not None:
+        return cached
+    with metrics.timer("assistant_completion_seconds", stage):
+        completion = rate_limit.create(client, stage, **kwargs)
+    metrics.record_usage(stage, completion.usage)
+    store(stage, key, completion)
+    return completion
+
+
+async def acreate(client, stage, **kwargs):
+    # The same for AsyncOpenAI clients.
+    cached, key = lookup(stage, **kwargs)
+    if cached is not None:
+        return cached
+    with metrics.timer("assistant_completion_seconds", stage):
+        completion = await rate_limit.acreate(client, stage, **kwargs)
+    metrics.record_usage(stage, completion.usage)
+    store(stage, key, completion)
+    return completion
+
+
+def answer_completion(model, content, tool_calls=None):
+    # A minimal completion holding a streamed answer, so streamed answers can be cached too.
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = [dict(tool_call) for tool_call in tool_calls]
+    return {
+        "id": "chatcmpl-cached",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if tool_calls else "stop",
+        }],
+    }
@@ -0,0 +1,160 @@
+# --------------------------------------------------------------
+# Conversation memory with a token budget
+#  -    openai_simple_chat.py only ever sends the system message and the newest
+#       question, so the assistant forgets everything you said before. Sending
+#       the whole history fixes that, but then every turn gets bigger, slower
+#       and more expensive than the last.
+#  -    Conversation keeps the history, but counts the tokens of each message
+#       once, when it is added, and keeps a running total. When the next
+#       request would go over the budget, the oldest turns are dropped, or,
+#       with summarize=..., folded into a short summary of the conversation.
+#  -    every request starts with the same "prefix": the system prompt and,
+#       once there is one, the summary. It stays exactly the same (byte for
+#       byte) from one turn to the next, because OpenAI's prompt caching only
+#       helps when a request starts the same way as an earlier one. To keep it
+#       that way for as long as possible, we trim down to low_water of the
+#       budget at once instead of one turn at a time, so the summary changes
+#       rarely.
+#  -    messages are kept as compact Message records (see message_records.py),
+#       since the HTTP service keeps one Conversation per session.
+#  -    token counts use tiktoken when it is installed (imported on the first
+#       count, since it is slow to load), and a rough 4-characters-per-token
+#       estimate otherwise.
+# --------------------------------------------------------------
+
+import os
+from collections import deque
+
+import rate_limit
+from message_records import Message
+
+
+# Every message costs a few tokens on top of its content (role, separators).
+MESSAGE_OVERHEAD = 4
+
+_encodings = {}
+# tiktoken, or None if it isn't installed; False until the first count.
+_tiktoken = False
+
+
+def _get_tiktoken():
+    global _tiktoken
+    if _tiktoken is False:
+        try:
+            import tiktoken
+        except ImportError:
+            tiktoken = None
+        _tiktoken = tiktoken
+    return _tiktoken
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    if not text:
+        return 0
+    tiktoken = _get_tiktoken()
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return len(_encodings[model].encode(text))
+
+
+def message_tokens(message, model="gpt-4o-mini"):
+    return MESSAGE_OVERHEAD + count_tokens(message.get("content") or "", model)
+
+
+class Conversation:
+    def __init__(self, system_prompt, budget=2000, low_water=0.75, summarize=None, model="gpt-4o-mini"):
+        self.budget = budget
+        self.low_water = low_water
+        self.summarize = summarize
+        self.model = model
+
+        self.system = Message("system", system_prompt)
+        self.system_tokens = message_tokens(self.system, model)
+        self.summary = None
+        self.summary_tokens = 0
+        # Each turn is ((question, answer), tokens), oldest first.
+        self.turns = deque()
+        self.history_tokens = 0
+        self.evicted_turns = 0
+
+    def prefix(self):
+        if self.summary is None:
+            return [self.system]
+        return [self.system, self.summary]
+
+    def prompt_tokens(self, extra=0):
+        return self.system_tokens + self.summary_tokens + self.history_tokens + extra
+
+    def prepare(self, user_input):
+        # The messages to send for a new question, trimmed to fit the budget.
+        question = Message("user", user_input)
+        question_tokens = message_tokens(question, self.model)
+        if self.prompt_tokens(question_tokens) > self.budget:
+            self._trim(question_tokens)
+
+        messages = self.prefix()
+        for turn, _ in self.turns:
+            messages.extend(turn)
+        messages.append(question)
+        return messages
+
+    def add_turn(self, user_input, answer):
+        turn = (Message("user", user_input), Message("assistant", answer))
+        tokens = sum(message_tokens(message, self.model) for message in turn)
+        self.turns.append((turn, tokens))
+        self.history_tokens += tokens
+
+    def _trim(self, question_tokens):
+        target = self.budget * self.low_water
+        evicted = []
+        while self.turns and self.prompt_tokens(question_tokens) > target:
+            turn, tokens = self.turns.popleft()
+            self.history_tokens -= tokens
+            evicted.extend(turn)
+            self.evicted_turns += 1
+
+        if evicted and self.summarize is not None:
+            previous = self.summary["content"] if self.summary else ""
+            text = self.summarize(previous, evicted)
+            self.summary = Message("system", f"Summary of the conversation so far: {text}")
+            self.summary_tokens = message_tokens(self.summary, self.model)
+
+
+def summarize_with(get_client, model="gpt-4o-mini"):
+    # A summarize function for Conversation that asks OpenAI to fold old turns into the summary.
+    # get_client() returns the OpenAI client; it is only called once there is something to summarize.
+    def summarize(previous, messages):
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        completion = rate_limit.create(
+            get_client(),
+            "summary",
+            model=model,
+            messages=[
+                {"role": "system", "content": "Update the summary of a conversation with the new messages. "
+                                              "Keep names, facts and preferences. Reply with the summary only, "
+                                              "in at most 100 words."},
+                {"role": "user", "content": f"Summary so far:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"},
+            ],
+        )
+        return completion.choices[0].message.content.strip()
+    return summarize
+
+
+def from_env(system_prompt, get_client, model="gpt-4o-mini"):
+    # CHAT_MEMORY=off (default) keeps the old one-question-at-a-time behaviour,
+    # "trim" drops old turns, and "summarize" folds them into a summary.
+    mode = os.getenv("CHAT_MEMORY", "off").lower()
+    if mode not in ("trim", "summarize"):
+        return None
+    return Conversation(
+        system_prompt,
+        budget=int(os.getenv("CHAT_TOKEN_BUDGET", "2000")),
+        low_water=float(os.getenv("CHAT_LOW_WATER", "0.75")),
+        summarize=summarize_with(get_client, model) if mode == "summarize" else None,
+        model=model,
+    )
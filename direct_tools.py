@@ -0,0 +1,43 @@
+# --------------------------------------------------------------
+# Tool calls we can work out without asking OpenAI
+#  -    the two-step input in openai_function_calling.py already tells us what
+#       the user wants ("temperature", "wind speed" or both), which is exactly
+#       which tools to call. Once we also know where the city is (see
+#       gazetteer.py), plan() builds the same tool calls the model would have
+#       made, so the first OpenAI request can be skipped.
+#  -    it also builds the assistant message that "made" those calls, so the
+#       conversation sent to OpenAI for the final answer looks just like it
+#       would have if the model had picked the tools itself.
+# --------------------------------------------------------------
+
+import json
+from types import SimpleNamespace
+
+
+# What the user asked for -> the tools that answer it
+QUESTION_TOOLS = {
+    "temperature": ["get_weather"],
+    "wind speed": ["get_wind_speed"],
+    "temperature and wind speed": ["get_weather", "get_wind_speed"],
+}
+
+
+def plan(what_they_want, latitude, longitude):
+    # Returns (assistant message, tool calls), or None if we don't know which tools to use.
+    names = QUESTION_TOOLS.get(what_they_want)
+    if names is None:
+        return None
+
+    arguments = json.dumps({"latitude": latitude, "longitude": longitude})
+    tool_calls = [
+        {"id": f"call_local_{i}", "type": "function", "function": {"name": name, "arguments": arguments}}
+        for i, name in enumerate(names)
+    ]
+    message = {"role": "assistant", "content": None, "tool_calls": tool_calls}
+
+    # The rest of the script reads tool calls as objects (tool_call.function.name), like the ones
+    # the OpenAI library gives us, so hand back the same data in that shape as well.
+    return message, [
+        SimpleNamespace(id=call["id"], type=call["type"], function=SimpleNamespace(**call["function"]))
+        for call in tool_calls
+    ]
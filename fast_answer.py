@@ -0,0 +1,79 @@
+# --------------------------------------------------------------
+# Answer simple questions without a second trip to OpenAI
+#  -    after the tools run, the scripts send everything back to OpenAI just to
+#       turn one or two numbers into a sentence. For the questions we know the
+#       shape of (temperature, wind speed, or both), we can write that sentence
+#       ourselves from a template and skip the second completion entirely.
+#  -    render() only does this when every tool call succeeded and the tools
+#       that ran are exactly the ones the question needs. Anything else returns
+#       None, and the script asks OpenAI as usual.
+#  -    turned on with FAST_ANSWERS=1. How often it could be used is logged on
+#       the "fast_answer" logger (set LOG_LEVEL=INFO to see it).
+# --------------------------------------------------------------
+
+import logging
+import os
+import threading
+
+from direct_tools import QUESTION_TOOLS
+from tool_executor import is_error
+
+
+logger = logging.getLogger("fast_answer")
+
+# Question shape -> the sentence to answer it with. The tools each shape needs are in direct_tools.QUESTION_TOOLS.
+TEMPLATES = {
+    "temperature": "It's currently {get_weather}°C in {city}.",
+    "wind speed": "The wind in {city} is currently blowing at {get_wind_speed} km/h.",
+    "temperature and wind speed": "It's currently {get_weather}°C in {city}, with wind speeds of {get_wind_speed} km/h.",
+}
+
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def enabled():
+    return os.getenv("FAST_ANSWERS", "0").lower() in ("1", "true", "yes")
+
+
+def _render(city, what_they_want, tool_calls, tool_messages):
+    if what_they_want not in TEMPLATES:
+        return None
+    needed, template = QUESTION_TOOLS[what_they_want], TEMPLATES[what_they_want]
+
+    # Exactly one call per needed tool; several calls (say, for different places) need the model.
+    names = sorted(tool_call.function.name for tool_call in tool_calls or [])
+    if names != sorted(needed):
+        return None
+    if any(is_error(message) for message in tool_messages):
+        return None
+
+    results = {}
+    for tool_call, message in zip(tool_calls, tool_messages):
+        results[tool_call.function.name] = message["content"]
+    return template.format(city=city, **results)
+
+
+def render(city, what_they_want, tool_calls, tool_messages):
+    # Returns the answer, or None if OpenAI should write it instead.
+    global hits, misses
+    if not enabled():
+        return None
+
+    text = _render(city, what_they_want, tool_calls, tool_messages)
+    with _lock:
+        if text is None:
+            misses += 1
+        else:
+            hits += 1
+        total = hits + misses
+        logger.info("fast answer %s; used for %d of %d turns (%.0f%%)",
+                    "used" if text is not None else "not used", hits, total, 100 * hits / total)
+    return text
+
+
+def stats():
+    with _lock:
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
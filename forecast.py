@@ -0,0 +1,367 @@
+# --------------------------------------------------------------
+# Shared forecast fetch for the weather tools
+#  -    get_weather and get_wind_speed both read from the same Open-Meteo
+#       "current" block, so instead of each tool calling the API on its own
+#       they both go through get_current() below. Within one turn, each
+#       (latitude, longitude) pair is fetched exactly once.
+#  -    across turns, ForecastCache keeps recent results around. Open-Meteo
+#       only updates "current" conditions every 15 minutes, so asking again
+#       before then just costs us a round trip.
+#  -    get_summary() is for questions about later on ("will it get windier
+#       this afternoon?"): it fetches the hourly forecast and sums it up with
+#       forecast_summary.py. It isn't cached; the hourly forecast is only
+#       asked for when a question needs it.
+#  -    when a turn asks about several places ("temperature in Boston, NYC and
+#       Philly"), prefetch() gets all of them in one request: Open-Meteo takes
+#       comma-separated lists of coordinates, up to FORECAST_BULK_SIZE of them.
+# --------------------------------------------------------------
+
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import http_transport
+from metrics import metrics
+from tool_executor import get_executor
+
+
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+
+# Only ask Open-Meteo for the values our tools actually read. The old URL also
+# requested a week of hourly data that nobody looked at.
+CURRENT_FIELDS = ("temperature_2m", "wind_speed_10m")
+
+# The hourly fields forecast_summary.py sums up.
+HOURLY_FIELDS = ("temperature_2m", "relative_humidity_2m", "wind_speed_10m")
+
+# Results fetched during the current turn, keyed by (latitude, longitude). Tool
+# calls may run on several threads at once (see tool_executor.py), so each entry
+# is a Future: the first caller fetches, everyone else asking for the same
+# coordinates waits on that fetch instead of starting their own.
+# The dict is per context, so turns run side by side on several threads don't
+# clear each other's; tool_executor.py runs each call in its turn's context.
+# Outside a turn (no start_turn()) there is none, and nothing is kept.
+_turn_forecasts = contextvars.ContextVar("turn_forecasts", default=None)
+_turn_lock = threading.Lock()
+
+# Requests to Open-Meteo in progress, keyed by the (latitude, longitude) asked for.
+# Unlike _turn_forecasts this is shared by every turn, so two conversations asking
+# about the same place at the same moment share one request ("single-flight").
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+# --------------------------------------------------------------
+# Cache of recent forecasts
+#  -    coordinates are snapped onto a grid (0.01 degrees is roughly 1 km),
+#       since the model returns slightly different numbers for the same city
+#  -    entries expire after ttl seconds and the least recently used entry is
+#       dropped once there are more than max_entries
+#  -    if path is given, entries are also written to a SQLite file so the
+#       next run starts with a warm cache
+#  -    all methods take a lock, since tool calls can run on several threads
+# --------------------------------------------------------------
+
+class ForecastCache:
+    def __init__(self, ttl=900, grid=0.01, max_entries=1024, path=None):
+        self.ttl = ttl
+        self.grid = grid
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._open(path)
+
+    def snap(self, latitude, longitude):
+        # round() twice: once to pick the grid cell, once to drop float noise like 41.879999999
+        return (round(round(latitude / self.grid) * self.grid, 6),
+                round(round(longitude / self.grid) * self.grid, 6))
+
+    def get(self, latitude, longitude):
+        key = self.snap(latitude, longitude)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                metrics.inc("assistant_cache_lookups_total", cache="forecast", result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.inc("assistant_cache_lookups_total", cache="forecast", result="hit")
+            return entry[1]
+
+    def put(self, latitude, longitude, current, fetched_at=None):
+        key = self.snap(latitude, longitude)
+        if fetched_at is None:
+            fetched_at = time.time()
+        with self._lock:
+            self._entries[key] = (fetched_at, current)
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?)",
+                        (key[0], key[1], fetched_at, json.dumps(current)),
+                    )
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+    # Callers must hold self._lock.
+    def _remove(self, key):
+        del self._entries[key]
+        if self._db is not None:
+            with self._db:
+                self._db.execute("DELETE FROM forecasts WHERE latitude = ? AND longitude = ?", key)
+
+    def _open(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS forecasts ("
+                "latitude REAL, longitude REAL, fetched_at REAL, current TEXT, "
+                "PRIMARY KEY (latitude, longitude))"
+            )
+            self._db.execute("DELETE FROM forecasts WHERE fetched_at < ?", (time.time() - self.ttl,))
+        # Oldest first, so the most recently fetched rows end up as the most recently used entries.
+        rows = self._db.execute(
+            "SELECT latitude, longitude, fetched_at, current FROM forecasts ORDER BY fetched_at"
+        ).fetchall()
+        for latitude, longitude, fetched_at, current in rows[-self.max_entries:]:
+            self._entries[(latitude, longitude)] = (fetched_at, json.loads(current))
+
+
+# The cache is built the first time it is needed rather than at import time, so
+# that the FORECAST_CACHE_* settings can come from the .env file loaded by the scripts.
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ForecastCache(
+                ttl=float(os.getenv("FORECAST_CACHE_TTL", "900")),
+                grid=float(os.getenv("FORECAST_CACHE_GRID", "0.01")),
+                max_entries=int(os.getenv("FORECAST_CACHE_SIZE", "1024")),
+                path=os.getenv("FORECAST_CACHE_PATH") or None,
+            )
+    return _cache
+
+
+def start_turn():
+    # Call this at the top of every turn so a new question gets fresh numbers.
+    _turn_forecasts.set({})
+
+
+def bulk_size():
+    # The most locations asked for in one request.
+    return int(os.getenv("FORECAST_BULK_SIZE", "50"))
+
+
+def forecast_params(points):
+    # Open-Meteo takes several locations at once as comma-separated lists.
+    return {
+        "latitude": ",".join(str(latitude) for latitude, _ in points),
+        "longitude": ",".join(str(longitude) for _, longitude in points),
+        "current": ",".join(CURRENT_FIELDS),
+    }
+
+
+def parse_currents(data, count):
+    # One location comes back as an object, several as a list in the order they were asked for.
+    locations = data if isinstance(data, list) else [data]
+    if len(locations) != count:
+        raise ValueError(f"asked Open-Meteo for {count} locations, got {len(locations)}")
+    return [location['current'] for location in locations]
+
+
+def fetch_many(points):
+    # http_transport.get() reuses pooled connections, times out and retries (see http_transport.py).
+    response = http_transport.get(FORECAST_URL, params=forecast_params(points))
+    response.raise_for_status()
+    return parse_currents(response.json(), len(points))
+
+
+def fetch_current(latitude, longitude):
+    return fetch_many([(latitude, longitude)])[0]
+
+
+def fetch_shared(points):
+    # Returns a Future per point. A point some other turn or thread is already fetching
+    # waits on that fetch; the rest are fetched here, bulk_size() per request.
+    futures, mine = [], []
+    with _inflight_lock:
+        for point in points:
+            future = _inflight.get(point)
+            if future is None:
+                future = _inflight[point] = Future()
+                mine.append((point, future))
+            futures.append(future)
+
+    size = bulk_size()
+    try:
+        for i in range(0, len(mine), size):
+            chunk = mine[i:i + size]
+            try:
+                currents = fetch_many([point for point, _ in chunk])
+            except Exception as e:
+                for _, future in chunk:
+                    future.set_exception(e)
+            else:
+                for (_, future), current in zip(chunk, currents):
+                    future.set_result(current)
+    finally:
+        with _inflight_lock:
+            for point, future in mine:
+                # Only if we were interrupted: don't leave anyone waiting forever.
+                future.cancel()
+                del _inflight[point]
+    return futures
+
+
+# The tools that read the current conditions. get_forecast_summary reads the hourly forecast
+# (see forecast_summary.py) instead, so there is nothing to prefetch for it.
+CURRENT_TOOLS = ("get_weather", "get_wind_speed")
+
+
+def tool_call_points(tool_calls):
+    # The (latitude, longitude) of every tool call that reads the current conditions.
+    points = []
+    for tool_call in tool_calls or []:
+        if tool_call.function.name not in CURRENT_TOOLS:
+            continue
+        try:
+            args = json.loads(tool_call.function.arguments)
+            points.append((float(args["latitude"]), float(args["longitude"])))
+        except (ValueError, KeyError, TypeError):
+            # Bad arguments are reported by the tool call itself.
+            continue
+    return points
+
+
+def _claim(points):
+    # Returns {point: Future} for this turn, and the points nobody is getting yet, which the caller has to.
+    futures, claimed = {}, []
+    turn = _turn_forecasts.get()
+    if turn is None:
+        turn = {}
+    with _turn_lock:
+        for point in points:
+            if point not in futures:
+                futures[point] = turn.get(point)
+                if futures[point] is None:
+                    futures[point] = turn[point] = Future()
+                    claimed.append(point)
+    return futures, claimed
+
+
+def prefetch(points):
+    # Makes sure every point has a forecast for this turn, fetching the ones that aren't
+    # cached in as few requests as possible. Returns {point: Future}.
+    futures, claimed = _claim(points)
+    _fill(futures, claimed)
+    return futures
+
+
+def start_prefetch(points):
+    # Like prefetch(), but the fetch runs on the tool pool. The points are claimed for the turn
+    # right away, so tool calls started after this wait on it (for at most TOOL_TIMEOUT, see
+    # tool_executor.collect()) instead of fetching on their own. Returns {point: Future}.
+    futures, claimed = _claim(points)
+    if claimed:
+        get_executor().submit(_fill, futures, claimed)
+    return futures
+
+
+def _fill(futures, claimed):
+    # A failed fetch stays in the turn as well, so the turn's other tool calls get the same
+    # error instead of sitting through the retries again. The next turn starts over.
+    cache = get_cache()
+    missing = []
+    for point in claimed:
+        current = cache.get(*point) if cache.ttl > 0 else None
+        if current is None:
+            missing.append(point)
+        else:
+            futures[point].set_result(current)
+
+    # Fetch the grid points themselves, so every caller that snaps to one gets the same answer.
+    keys = [cache.snap(*point) if cache.ttl > 0 else point for point in missing]
+    try:
+        shared = fetch_shared(keys)
+    except BaseException as e:
+        for point in missing:
+            futures[point].set_exception(e)
+        raise
+    for point, result in zip(missing, shared):
+        try:
+            current = result.result()
+        except BaseException as e:
+            futures[point].set_exception(e)
+            continue
+        if cache.ttl > 0:
+            cache.put(*point, current)
+        futures[point].set_result(current)
+
+
+
+def get_current(latitude, longitude):
+    key = (latitude, longitude)
+    return prefetch([key])[key].result()
+
+
+def adopt(point, future):
+    # Answer point from a fetch for nearby coordinates for the rest of this turn
+    # (see speculation.py), unless the turn already has a forecast for it.
+    turn = _turn_forecasts.get()
+    if turn is None:
+        return
+    with _turn_lock:
+        turn.setdefault(point, future)
+
+
+def hourly_params(latitude, longitude, days):
+    # timezone=auto gives the hours in local time, so "afternoon" means the place's afternoon.
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "hourly": ",".join(HOURLY_FIELDS),
+        "forecast_days": days,
+        "timezone": "auto",
+    }
+
+
+def fetch_hourly(latitude, longitude, days):
+    response = http_transport.get(FORECAST_URL, params=hourly_params(latitude, longitude, days))
+    response.raise_for_status()
+    return response.json()['hourly']
+
+
+def get_summary(latitude, longitude, days):
+    # numpy takes a moment to import, so forecast_summary is only imported once a question needs it.
+    import forecast_summary
+
+    days = max(1, min(days, forecast_summary.MAX_DAYS))
+    return forecast_summary.summarize(fetch_hourly(latitude, longitude, days), days)
@@ -0,0 +1,98 @@
+# --------------------------------------------------------------
+# Hourly forecast, summed up for the model
+#  -    get_weather and get_wind_speed only know about right now, so "will it
+#       get windier this afternoon?" can't be answered. Open-Meteo has the
+#       hourly forecast too, but handing the model the raw arrays (24 values a
+#       day for each field, plus 24 timestamps) costs thousands of prompt
+#       tokens for a few numbers' worth of information.
+#  -    summarize() turns the hourly arrays into a short text instead: for each
+#       day and each field, the min, max, mean, the hour of the peak, the trend
+#       (least-squares slope, per hour) and the mean of each part of the day
+#       (night 0-6h, morning 6-12h, afternoon 12-18h, evening 18-24h).
+#  -    at most MAX_DAYS days are summed up, so the tool message is the same
+#       size however long the forecast is (about 75 tokens per day).
+#  -    all of it is computed with NumPy on a (field, day, hour) grid at once,
+#       no Python loops over hours. Hours missing from the forecast are NaN
+#       and left out of every aggregate.
+# --------------------------------------------------------------
+
+import warnings
+
+import numpy as np
+
+
+MAX_DAYS = 3
+
+# Open-Meteo field -> the label and unit used in the summary.
+FIELDS = {
+    "temperature_2m": "temp °C",
+    "relative_humidity_2m": "humidity %",
+    "wind_speed_10m": "wind km/h",
+}
+
+PARTS = ("night", "morning", "afternoon", "evening")
+
+HOURS = np.arange(24)
+
+
+def to_grid(hourly, days=MAX_DAYS):
+    # The hourly block as a (field, day, hour) array, starting on the first day in it, and the dates.
+    times = np.array(hourly["time"], dtype="datetime64[m]")
+    dates = times.astype("datetime64[D]")
+    if not len(times):
+        # No days at all.
+        return np.full((len(FIELDS), 0, 24), np.nan), dates
+    hours = ((times - dates) // np.timedelta64(1, "h")).astype(int)
+    day_index = (dates - dates[0]).astype(int)
+    keep = day_index < days
+
+    values = np.array([hourly.get(field, [None] * len(times)) for field in FIELDS], dtype=float)
+    days = min(days, int(day_index.max()) + 1)
+    grid = np.full((len(FIELDS), days, 24), np.nan)
+    grid[:, day_index[keep], hours[keep]] = values[:, keep]
+    return grid, dates[0] + np.arange(days)
+
+
+def aggregates(grid):
+    # Everything summarize() reports, each with the grid's shape minus the hour axis.
+    present = ~np.isnan(grid)
+    count = present.sum(-1)
+    # All-NaN days (and days with a single hour, for the trend) come out as NaN; no need to warn about them.
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low = np.nanmin(grid, -1)
+        high = np.nanmax(grid, -1)
+        mean = np.nanmean(grid, -1)
+        peak_hour = np.where(present, grid, -np.inf).argmax(-1)
+        # Least-squares slope of value against hour, over the hours present.
+        hour_mean = (present * HOURS).sum(-1) / count
+        hour_offset = np.where(present, HOURS - hour_mean[..., None], 0.0)
+        value_offset = np.where(present, grid - mean[..., None], 0.0)
+        trend = (hour_offset * value_offset).sum(-1) / (hour_offset ** 2).sum(-1)
+        parts = np.nanmean(grid.reshape(*grid.shape[:-1], len(PARTS), 24 // len(PARTS)), -1)
+    return low, high, mean, peak_hour, trend, parts
+
+
+def _number(value, digits=1, sign=""):
+    return "n/a" if np.isnan(value) else f"{value:{sign}.{digits}f}"
+
+
+def summarize(hourly, days=MAX_DAYS):
+    # hourly is the "hourly" block of an Open-Meteo response, with times in local time.
+    days = max(1, min(int(days), MAX_DAYS))
+    grid, dates = to_grid(hourly, days)
+    if not len(dates):
+        return "no hourly data in the forecast"
+    low, high, mean, peak_hour, trend, parts = aggregates(grid)
+
+    lines = [f"hourly forecast by day (local time); parts: {', '.join(PARTS)}"]
+    for d, date in enumerate(dates):
+        for f, label in enumerate(FIELDS.values()):
+            if np.isnan(mean[f, d]):
+                continue
+            lines.append(
+                f"{date} {label}: min {_number(low[f, d])} max {_number(high[f, d])} mean {_number(mean[f, d])} "
+                f"peak {peak_hour[f, d]}h trend {_number(trend[f, d], 2, '+')}/h "
+                f"parts {' '.join(_number(value) for value in parts[f, d])}"
+            )
+    return "\n".join(lines)
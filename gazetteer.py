@@ -0,0 +1,279 @@
+# --------------------------------------------------------------
+# Offline city -> coordinates lookup
+#  -    most of the first OpenAI request in openai_function_calling.py is the
+#       model turning a city name into a latitude and longitude. If we can
+#       look the city up ourselves, we can call the tools straight away and
+#       skip that request.
+#  -    the city list is a GeoNames-style file (data/cities.txt is a small
+#       sample; point GAZETTEER_SOURCE at a real cities15000.txt for full
+#       coverage). It is turned into a compact binary index once, and after
+#       that the index is memory-mapped instead of parsed, so loading it takes
+#       milliseconds no matter how many cities it has.
+#  -    names are matched ignoring case and accents ("sao paulo" finds
+#       "São Paulo"), including GeoNames' alternate names ("Munich" finds
+#       "München"). When several places share a name, the biggest one wins if
+#       it is clearly bigger than the rest (Paris, France over Paris, Texas);
+#       otherwise the name is ambiguous and resolve() gives up. "Springfield, MO"
+#       narrows things down by country code or state/region code.
+#  -    if the index can't be built or read, resolve() and candidates() find
+#       nothing (logged on the "gazetteer" logger) and OpenAI does the lookup.
+#
+#  python gazetteer.py build [source.txt] [index.bin]     rebuild the index
+#  python gazetteer.py lookup "sao paulo"                  try a lookup
+# --------------------------------------------------------------
+
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import unicodedata
+from array import array
+from collections import namedtuple
+
+
+logger = logging.getLogger("gazetteer")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_SOURCE = os.path.join(DATA_DIR, "cities.txt")
+DEFAULT_INDEX = os.path.join(DATA_DIR, "gazetteer.bin")
+
+# The index stores numbers in this machine's byte order, so the magic says which one.
+MAGIC = b"GZL1" if sys.byteorder == "little" else b"GZB1"
+# magic, number of places, number of name keys, size of the names blob, size of the keys blob
+HEADER = struct.Struct("=4sIIII4x")
+
+Place = namedtuple("Place", ["name", "country", "admin1", "latitude", "longitude", "population"])
+
+
+def normalize(text):
+    # "São Paulo" -> "sao paulo", "St. Louis" -> "st louis"
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return re.sub(r"[\W_]+", " ", text).strip()
+
+
+# --------------------------------------------------------------
+# Building the index
+#  -    one row per place, stored column by column: latitudes and longitudes
+#       as doubles, populations as uint32, and "name\tcountry\tadmin1" in one
+#       string blob with an offsets array
+#  -    every name a place is known by becomes a normalized key; the keys are
+#       sorted, stored back to back in a blob, and each points at its place, so
+#       exact and prefix lookups are a binary search
+# --------------------------------------------------------------
+
+def read_geonames(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            names = {cols[1], cols[2], *cols[3].split(",")}
+            yield (cols[1], cols[8], cols[10], float(cols[4]), float(cols[5]), int(cols[14] or 0), names)
+
+
+def build(source=DEFAULT_SOURCE, index=DEFAULT_INDEX):
+    latitudes, longitudes, populations = array("d"), array("d"), array("I")
+    name_offsets, names_blob = array("I", [0]), bytearray()
+    keys = set()
+
+    for place_id, (name, country, admin1, latitude, longitude, population, aliases) in enumerate(read_geonames(source)):
+        latitudes.append(latitude)
+        longitudes.append(longitude)
+        populations.append(min(population, 2 ** 32 - 1))
+        names_blob += f"{name}\t{country}\t{admin1}".encode()
+        name_offsets.append(len(names_blob))
+        for alias in aliases:
+            key = normalize(alias)
+            if key:
+                keys.add((key.encode(), place_id))
+
+    key_offsets, key_places, keys_blob = array("I", [0]), array("I"), bytearray()
+    for key, place_id in sorted(keys):
+        keys_blob += key
+        key_offsets.append(len(keys_blob))
+        key_places.append(place_id)
+
+    # Write to a temporary file first, so a reader never maps a half-written index.
+    tmp = index + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(latitudes), len(key_places), len(names_blob), len(keys_blob)))
+        # The doubles go first, right after the 24-byte header, so they are 8-byte aligned.
+        for column in (latitudes, longitudes, populations, name_offsets, key_offsets, key_places):
+            column.tofile(f)
+        f.write(names_blob)
+        f.write(keys_blob)
+    os.replace(tmp, index)
+    return len(latitudes), len(key_places)
+
+
+# --------------------------------------------------------------
+# Reading the index
+# --------------------------------------------------------------
+
+class Gazetteer:
+    def __init__(self, path=DEFAULT_INDEX, ambiguity_ratio=5.0):
+        # A place only wins over others with the same name if it is this many times bigger.
+        self.ambiguity_ratio = ambiguity_ratio
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        magic, places, keys, names_size, keys_size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a gazetteer index for this machine")
+        self.size = places
+
+        offset = HEADER.size
+
+        def column(fmt, count):
+            nonlocal offset
+            width = struct.calcsize(fmt)
+            data = view[offset:offset + count * width].cast(fmt)
+            offset += count * width
+            return data
+
+        self._latitudes = column("d", places)
+        self._longitudes = column("d", places)
+        self._populations = column("I", places)
+        self._name_offsets = column("I", places + 1)
+        self._key_offsets = column("I", keys + 1)
+        self._key_places = column("I", keys)
+        self._names = view[offset:offset + names_size]
+        offset += names_size
+        self._keys = view[offset:offset + keys_size]
+
+    def place(self, place_id):
+        name, country, admin1 = bytes(
+            self._names[self._name_offsets[place_id]:self._name_offsets[place_id + 1]]).decode().split("\t")
+        return Place(name, country, admin1, self._latitudes[place_id], self._longitudes[place_id],
+                     self._populations[place_id])
+
+    def _key(self, i):
+        return bytes(self._keys[self._key_offsets[i]:self._key_offsets[i + 1]])
+
+    def _lower_bound(self, key):
+        low, high = 0, len(self._key_places)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _ranked(self, place_ids):
+        return sorted((self.place(place_id) for place_id in set(place_ids)), key=lambda place: -place.population)
+
+    def find(self, name):
+        # Every place called exactly `name`, biggest first.
+        key = normalize(name).encode()
+        i = self._lower_bound(key)
+        place_ids = []
+        while i < len(self._key_places) and self._key(i) == key:
+            place_ids.append(self._key_places[i])
+            i += 1
+        return self._ranked(place_ids)
+
+    def complete(self, prefix, limit=10):
+        # Places with a name starting with `prefix`, biggest first.
+        key = normalize(prefix).encode()
+        i = self._lower_bound(key)
+        place_ids = []
+        while i < len(self._key_places) and self._key(i).startswith(key):
+            place_ids.append(self._key_places[i])
+            i += 1
+        return self._ranked(place_ids)[:limit]
+
+    def candidates(self, query):
+        # Every place `query` could mean, biggest first.
+        name, _, qualifier = query.partition(",")
+        candidates = self.find(name)
+        qualifier = normalize(qualifier)
+        if qualifier:
+            candidates = [place for place in candidates
+                          if qualifier in (normalize(place.country), normalize(place.admin1))]
+        return candidates
+
+    def resolve(self, query):
+        # The one place `query` most likely means, or None if we can't tell.
+        candidates = self.candidates(query)
+        if not candidates:
+            return None
+        if len(candidates) == 1 or candidates[0].population >= self.ambiguity_ratio * candidates[1].population:
+            return candidates[0]
+        return None
+
+
+# The index is opened the first time it is needed, and (re)built first if it is
+# missing or older than the source file.
+_gazetteer = None
+_lock = threading.Lock()
+
+
+def enabled():
+    # Set USE_GAZETTEER=0 in .env to always let OpenAI find the coordinates.
+    return os.getenv("USE_GAZETTEER", "1").lower() not in ("0", "false", "no")
+
+
+def get_gazetteer():
+    global _gazetteer
+    with _lock:
+        if _gazetteer is None:
+            source = os.getenv("GAZETTEER_SOURCE", DEFAULT_SOURCE)
+            index = os.getenv("GAZETTEER_INDEX", DEFAULT_INDEX)
+            if not os.path.exists(index) or os.path.getmtime(index) < os.path.getmtime(source):
+                build(source, index)
+            try:
+                _gazetteer = Gazetteer(index)
+            except ValueError:
+                # Built on a machine with the other byte order; rebuild it for this one.
+                build(source, index)
+                _gazetteer = Gazetteer(index)
+    return _gazetteer
+
+
+def _open():
+    # The gazetteer, or None if it is turned off or the index can't be built or
+    # read (say the source file is missing); then OpenAI finds the coordinates.
+    if not enabled():
+        return None
+    try:
+        return get_gazetteer()
+    except OSError as e:
+        logger.warning("gazetteer unavailable: %s", e)
+        return None
+
+
+def resolve(city):
+    gazetteer = _open()
+    return gazetteer.resolve(city) if gazetteer is not None else None
+
+
+def candidates(city):
+    gazetteer = _open()
+    return gazetteer.candidates(city) if gazetteer is not None else []
+
+
+if __name__ == "__main__":
+    import time
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "build":
+        source = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_SOURCE
+        index = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_INDEX
+        places, keys = build(source, index)
+        print(f"Wrote {index}: {places} places, {keys} names")
+    elif len(sys.argv) >= 3 and sys.argv[1] == "lookup":
+        started = time.perf_counter()
+        gazetteer = get_gazetteer()
+        loaded = time.perf_counter()
+        print(f"Loaded {gazetteer.size} places in {(loaded - started) * 1000:.2f} ms")
+        print("resolve:", gazetteer.resolve(sys.argv[2]))
+        for place in gazetteer.find(sys.argv[2].partition(",")[0]):
+            print("  ", place)
+        print(f"Lookup took {(time.perf_counter() - loaded) * 1000:.2f} ms")
+    else:
+        print(__doc__ or "usage: python gazetteer.py build [source] [index] | lookup NAME")
@@ -0,0 +1,151 @@
+# --------------------------------------------------------------
+# Shared HTTP transport for the tool functions
+#  -    calling requests.get() on its own opens a brand new connection (TCP and
+#       TLS handshake included) for every request, never gives up on a stalled
+#       socket, and never retries. get() below goes through one shared Session
+#       instead, so connections are pooled and kept alive between tool calls.
+#  -    every request has a connect and a read timeout, and connection errors,
+#       timeouts and 5xx responses are retried a few times with jittered
+#       exponential backoff.
+#  -    every attempt is logged with its latency on the "http_transport"
+#       logger (set LOG_LEVEL=INFO to see them), and recorded in metrics.py.
+#  -    warm() makes a HEAD request through the same Session, to open or keep
+#       open a pooled connection before the tools need it.
+#  -    async_get() does the same for the httpx.AsyncClient used by
+#       openai_async_function_calling.py.
+#  -    requests and httpx are only imported when the first request is made,
+#       so the scripts can show their first prompt without waiting on them.
+# --------------------------------------------------------------
+
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from metrics import metrics
+
+
+logger = logging.getLogger("http_transport")
+
+
+# Settings are read the first time they are needed, so they can come from the
+# .env file loaded by the scripts.
+class Settings:
+    def __init__(self):
+        self.pool_size = int(os.getenv("HTTP_POOL_SIZE", "10"))
+        self.connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+        self.read_timeout = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+        self.retries = int(os.getenv("HTTP_RETRIES", "2"))
+        self.backoff = float(os.getenv("HTTP_BACKOFF", "0.25"))
+        self.max_backoff = float(os.getenv("HTTP_MAX_BACKOFF", "4"))
+
+    def delay(self, attempt):
+        # "Full jitter": a random wait up to the exponential backoff, so many
+        # clients retrying at once don't all hit the server at the same moment.
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+_settings = None
+_session = None
+_lock = threading.Lock()
+
+
+def get_settings():
+    global _settings
+    with _lock:
+        if _settings is None:
+            _settings = Settings()
+    return _settings
+
+
+def get_session():
+    global _session
+    settings = get_settings()
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=settings.pool_size, pool_maxsize=settings.pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+    return _session
+
+
+def _log(url, attempt, started, outcome):
+    parts = urlsplit(url)
+    seconds = time.perf_counter() - started
+    logger.info("GET %s%s -> %s in %.0f ms (attempt %d)",
+                parts.netloc, parts.path, outcome, seconds * 1000, attempt + 1)
+    metrics.observe("assistant_http_request_seconds", seconds, host=parts.netloc)
+    metrics.trace("http_request", host=parts.netloc, path=parts.path, outcome=str(outcome),
+                  attempt=attempt + 1, duration_ms=round(seconds * 1000, 3))
+    if not isinstance(outcome, int) or outcome >= 500:
+        metrics.inc("assistant_errors_total", stage="http")
+
+
+def get(url, params=None):
+    import requests
+
+    settings = get_settings()
+    session = get_session()
+    for attempt in range(settings.retries + 1):
+        started = time.perf_counter()
+        try:
+            response = session.get(url, params=params, timeout=(settings.connect_timeout, settings.read_timeout))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _log(url, attempt, started, type(e).__name__)
+            if attempt == settings.retries:
+                raise
+        else:
+            _log(url, attempt, started, response.status_code)
+            if response.status_code < 500 or attempt == settings.retries:
+                return response
+            # Hand the connection back to the pool before trying again.
+            response.close()
+        time.sleep(settings.delay(attempt))
+
+
+def warm(url):
+    # Opens a pooled connection to url's host, or keeps one open, with a HEAD request (see prewarm.py).
+    # Not retried, and not counted with the tools' requests in metrics.py. Returns the status code.
+    settings = get_settings()
+    # The (empty) body has been read by the time head() returns, so the connection is back in the pool.
+    return get_session().head(url, timeout=(settings.connect_timeout, settings.read_timeout)).status_code
+
+
+def make_async_client():
+    import httpx
+
+    settings = get_settings()
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("FORECAST_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("FORECAST_MAX_KEEPALIVE", "20")),
+        ),
+        timeout=httpx.Timeout(settings.read_timeout, connect=settings.connect_timeout),
+    )
+
+
+async def async_get(http, url, params=None):
+    import asyncio
+    import httpx
+
+    settings = get_settings()
+    for attempt in range(settings.retries + 1):
+        started = time.perf_counter()
+        try:
+            response = await http.get(url, params=params)
+        except httpx.TransportError as e:
+            _log(url, attempt, started, type(e).__name__)
+            if attempt == settings.retries:
+                raise
+        else:
+            _log(url, attempt, started, response.status_code)
+            if response.status_code < 500 or attempt == settings.retries:
+                return response
+            await response.aclose()
+        await asyncio.sleep(settings.delay(attempt))
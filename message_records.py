@@ -0,0 +1,112 @@
+# --------------------------------------------------------------
+# Compact messages for conversations that stay in memory
+#  -    messages.append(completion.choices[0].message) keeps the whole
+#       ChatCompletionMessage the OpenAI library built: a pydantic object with
+#       a dozen fields (refusal, audio, annotations, ...), most of them None,
+#       plus the same again for every tool call. Fine for one turn, but the
+#       HTTP service keeps thousands of conversations around.
+#  -    Message and ToolCall keep only what the next request needs (role,
+#       content, tool call ids, names and arguments) in __slots__, so there is
+#       no per-object __dict__. Roles and tool names are interned: every
+#       "assistant" and "get_weather" in memory is the same string object.
+#  -    both are read-only mappings laid out exactly like the request body
+#       ({"role": ..., "content": ..., "tool_calls": [...]}), so they go
+#       straight into messages=... and anything that reads message["content"]
+#       or message.get("tool_calls") keeps working. Nothing is converted back
+#       into dicts before a request.
+#  -    compact() turns any message we get (an SDK object, a dict, a Message)
+#       into a Message; tool_result() builds the "tool" message for a result.
+#  -    benchmarks/bench_memory.py measures the bytes per session saved.
+# --------------------------------------------------------------
+
+import sys
+from collections.abc import Mapping
+
+
+class ToolCall(Mapping):
+    __slots__ = ("id", "name", "arguments")
+
+    def __init__(self, id, name, arguments):
+        self.id = id
+        self.name = sys.intern(name)
+        self.arguments = arguments
+
+    def __getitem__(self, key):
+        if key == "id":
+            return self.id
+        if key == "type":
+            return "function"
+        if key == "function":
+            return {"name": self.name, "arguments": self.arguments}
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("id", "type", "function"))
+
+    def __len__(self):
+        return 3
+
+    def __repr__(self):
+        return f"ToolCall({self.id!r}, {self.name!r}, {self.arguments!r})"
+
+
+class Message(Mapping):
+    __slots__ = ("role", "content", "tool_calls", "tool_call_id")
+
+    def __init__(self, role, content=None, tool_calls=None, tool_call_id=None):
+        self.role = sys.intern(role)
+        self.content = content
+        # A tuple is smaller than a list, and nobody appends to it.
+        self.tool_calls = tuple(tool_calls) if tool_calls else None
+        self.tool_call_id = tool_call_id
+
+    # Same keys as the OpenAI library sends: role and content (null for an assistant
+    # message that only has tool calls) always, the other two only when set.
+    def __getitem__(self, key):
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        value = getattr(self, key, None) if key in Message.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key for key in Message.__slots__ if key in ("role", "content") or getattr(self, key) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Message({dict(self)!r})"
+
+
+def _field(value, key):
+    # Reads a field from either a dict or an object from the OpenAI library.
+    if isinstance(value, Mapping):
+        return value.get(key)
+    return getattr(value, key, None)
+
+
+def compact_tool_call(tool_call):
+    if isinstance(tool_call, ToolCall):
+        return tool_call
+    function = _field(tool_call, "function")
+    return ToolCall(_field(tool_call, "id"), _field(function, "name"), _field(function, "arguments"))
+
+
+def compact(message):
+    if isinstance(message, Message):
+        return message
+    tool_calls = _field(message, "tool_calls")
+    return Message(
+        _field(message, "role"),
+        _field(message, "content"),
+        [compact_tool_call(tool_call) for tool_call in tool_calls] if tool_calls else None,
+        _field(message, "tool_call_id"),
+    )
+
+
+def tool_result(tool_call_id, content):
+    return Message("tool", content, tool_call_id=tool_call_id)
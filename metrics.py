@@ -0,0 +1,203 @@
+# --------------------------------------------------------------
+# Where does the time go?
+#  -    every stage of a turn reports here: each OpenAI completion (by stage),
+#       each tool call, each Open-Meteo request, plus token usage, cache hits
+#       and errors. Latencies go into histograms, everything else into counters.
+#  -    three ways to look at the numbers, all switched on from .env:
+#           METRICS_PORT=9100          serves them in Prometheus' text format at
+#                                      http://localhost:9100/metrics
+#           METRICS_TRACE_PATH=f.jsonl writes one JSON line per timed event
+#           PROFILE=turns.prof         runs the whole script under cProfile and
+#                                      saves the stats on exit (read them with
+#                                      python -m pstats turns.prof)
+#  -    the scripts call start_from_env() once, after loading .env.
+# --------------------------------------------------------------
+
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "assistant_completion_seconds": ("histogram", "Time spent in OpenAI chat completions, by stage."),
+    "assistant_tool_seconds": ("histogram", "Time spent running each tool call."),
+    "assistant_http_request_seconds": ("histogram", "Time per HTTP request attempt made by the tools."),
+    "assistant_tokens_total": ("counter", "Tokens used by OpenAI completions, by stage and kind."),
+    "assistant_cache_lookups_total": ("counter", "Cache lookups, by cache and result."),
+    "assistant_errors_total": ("counter", "Errors, by stage."),
+    "assistant_server_requests_total": ("counter", "Requests to openai_server.py, by endpoint and status."),
+    "assistant_rate_limit_wait_seconds": ("histogram", "Time OpenAI requests waited on the rate limits, by stage."),
+    "assistant_retries_total": ("counter", "OpenAI requests retried, by stage and reason."),
+    "assistant_cost_dollars_total": ("counter", "Estimated cost of OpenAI completions in dollars, by stage and model."),
+    "assistant_prewarm_seconds": ("histogram", "Time spent warming up connections while waiting on input, by host."),
+    "assistant_tool_selections_total": ("counter", "Tool selections, by the first model asked and result (ok or escalated)."),
+}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    # The Prometheus text format wants backslashes, double quotes and newlines in label values escaped.
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._trace = None
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def trace(self, event, **fields):
+        if self._trace is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 6), "event": event, **fields})
+        with self._lock:
+            self._trace.write(line + "\n")
+            self._trace.flush()
+
+    @contextmanager
+    def timer(self, name, stage, **labels):
+        # with metrics.timer("assistant_tool_seconds", "tool", tool="get_weather"): ...
+        # An exception raised inside the block is counted as an error for the stage.
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            self.inc("assistant_errors_total", stage=stage)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe(name, seconds, stage=stage, **labels)
+            self.trace(name, stage=stage, duration_ms=round(seconds * 1000, 3), error=error, **labels)
+
+    def record_usage(self, stage, usage):
+        if usage is None:
+            return
+        self.inc("assistant_tokens_total", usage.prompt_tokens or 0, stage=stage, kind="prompt")
+        self.inc("assistant_tokens_total", usage.completion_tokens or 0, stage=stage, kind="completion")
+        self.trace("usage", stage=stage, prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+    def open_trace(self, path):
+        self._trace = open(path, "a")
+
+    def prometheus_text(self):
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for name, (kind, help_text) in HELP.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket in zip(BUCKETS + ("+Inf",), counts):
+                        cumulative += bucket
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            else:
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def serve(port, host="127.0.0.1"):
+    # http.server is imported here rather than at the top, since most runs never serve metrics.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def _start_profile(path):
+    import cProfile
+
+    profile = cProfile.Profile()
+    profile.enable()
+
+    def save():
+        profile.disable()
+        profile.dump_stats(path)
+
+    atexit.register(save)
+
+
+def start_from_env():
+    port = os.getenv("METRICS_PORT")
+    if port:
+        serve(int(port))
+    trace_path = os.getenv("METRICS_TRACE_PATH")
+    if trace_path:
+        metrics.open_trace(trace_path)
+    profile_path = os.getenv("PROFILE")
+    if profile_path:
+        _start_profile(profile_path)
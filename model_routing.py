@@ -0,0 +1,180 @@
+# --------------------------------------------------------------
+# Which model answers each stage
+#  -    both scripts asked gpt-4o for everything. Picking one of a few tools
+#       and writing down a city's coordinates doesn't need it, so the tool
+#       selection goes to TOOL_MODEL (gpt-4o-mini) first, and only the answer
+#       goes to ANSWER_MODEL (gpt-4o).
+#  -    check() looks over what the cheap model came back with: at least one
+#       tool call, every one naming a registered tool with arguments that pass
+#       the registry's checks (see tool_registry.py), and latitude / longitude
+#       that are on the globe. If anything is off, select_tools() asks
+#       ESCALATION_MODEL (gpt-4o) instead and uses its tool calls. Setting
+#       TOOL_MODEL to the same model as ESCALATION_MODEL turns the check off.
+#  -    every completion's latency and cost (from its token usage and PRICES,
+#       in dollars per million tokens) is logged on the "model_routing" logger
+#       (set LOG_LEVEL=INFO to see it) and counted in metrics.py, along with
+#       how often tool selection escalated. stats() sums it up per stage, so
+#       the split can be tuned.
+# --------------------------------------------------------------
+
+import json
+import logging
+import os
+import threading
+import time
+
+import completion_cache
+import rate_limit
+from metrics import metrics
+from tool_registry import ToolArgumentError
+
+
+logger = logging.getLogger("model_routing")
+
+# model -> (dollars per million prompt tokens, dollars per million completion tokens)
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Arguments the check keeps in range, -> (lowest, highest)
+RANGES = {
+    "latitude": (-90.0, 90.0),
+    "longitude": (-180.0, 180.0),
+}
+
+# stage -> running totals, see stats()
+_stages = {}
+_lock = threading.Lock()
+
+
+def tool_model():
+    return os.getenv("TOOL_MODEL", "gpt-4o-mini")
+
+
+def escalation_model():
+    return os.getenv("ESCALATION_MODEL", "gpt-4o")
+
+
+def answer_model():
+    return os.getenv("ANSWER_MODEL", "gpt-4o")
+
+
+def can_escalate():
+    return tool_model() != escalation_model()
+
+
+def cost(model, usage):
+    # Dated snapshots ("gpt-4o-2024-08-06") cost the same as the model they are a snapshot of.
+    if usage is None:
+        return 0.0
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            prompt, completion = PRICES[name]
+            return ((usage.prompt_tokens or 0) * prompt + (usage.completion_tokens or 0) * completion) / 1e6
+    return 0.0
+
+
+def check(tool_calls, registry):
+    # Returns what is wrong with the tool calls, or None if they look usable.
+    if not tool_calls:
+        return "no tool calls"
+    for tool_call in tool_calls:
+        name = tool_call.function.name
+        if name not in registry:
+            return f"unknown tool {name!r}"
+        try:
+            args = json.loads(tool_call.function.arguments)
+            registry.get(name).validate(args)
+        except (ValueError, ToolArgumentError) as e:
+            return f"bad arguments for {name}: {e}"
+        for arg, (low, high) in RANGES.items():
+            if arg in args and not low <= args[arg] <= high:
+                return f"{arg} {args[arg]} out of range for {name}"
+    return None
+
+
+def _totals(stage):
+    # Call with _lock held.
+    return _stages.setdefault(stage, {"requests": 0, "seconds": 0.0, "cost": 0.0, "turns": 0, "escalations": 0})
+
+
+def record(stage, model, seconds, usage):
+    # Completions served from cache (which come without usage) cost nothing, and aren't counted.
+    if usage is None:
+        return
+    dollars = cost(model, usage)
+    metrics.inc("assistant_cost_dollars_total", dollars, stage=stage, model=model)
+    with _lock:
+        totals = _totals(stage)
+        totals["requests"] += 1
+        totals["seconds"] += seconds
+        totals["cost"] += dollars
+    logger.info("%s: %s in %.0f ms, $%.6f", stage, model, seconds * 1000, dollars)
+
+
+def create(client, stage, model, cacheable=None, **kwargs):
+    # completion_cache.create() with the stage's model, keeping score of how long it took and what it cost.
+    # If cacheable is given, only completions it returns True for are stored in the completion cache.
+    cached, key = completion_cache.lookup(stage, model=model, **kwargs)
+    if cached is not None:
+        return cached
+    started = time.perf_counter()
+    with metrics.timer("assistant_completion_seconds", stage):
+        completion = rate_limit.create(client, stage, model=model, **kwargs)
+    elapsed = time.perf_counter() - started
+    metrics.record_usage(stage, completion.usage)
+    if cacheable is None or cacheable(completion):
+        completion_cache.store(stage, key, completion)
+    record(stage, model, elapsed, completion.usage)
+    return completion
+
+
+def _checks_out(registry):
+    # For create(): a tool selection that fails check() isn't cached, or every time the question
+    # came back it would be escalated all over again.
+    return lambda completion: check(completion.choices[0].message.tool_calls, registry) is None
+
+
+def select_tools(client, registry, messages, **kwargs):
+    # The tool selection stage. Returns (assistant message, tool calls, whether it escalated).
+    completion = create(client, "tool_selection", tool_model(), _checks_out(registry), messages=messages,
+                        tools=registry.tools, **kwargs)
+    message = completion.choices[0].message
+    return escalate(client, registry, messages, message, message.tool_calls, **kwargs)
+
+
+def escalate(client, registry, messages, message, tool_calls, **kwargs):
+    # Asks the escalation model again if the tool model's tool calls don't pass check(). Also for
+    # tool calls that were streamed (see streaming.stream_tool_calls()).
+    # Returns (assistant message, tool calls, whether it escalated). The tool calls are a list,
+    # empty if neither model made any; the answer is then asked for without them.
+    problem = check(tool_calls, registry) if can_escalate() else None
+    if problem is not None:
+        logger.info("tool_selection: escalating from %s to %s: %s", tool_model(), escalation_model(), problem)
+        completion = create(client, "tool_selection", escalation_model(), _checks_out(registry), messages=messages,
+                            tools=registry.tools, **kwargs)
+        message = completion.choices[0].message
+        tool_calls = message.tool_calls
+    with _lock:
+        totals = _totals("tool_selection")
+        totals["turns"] += 1
+        totals["escalations"] += problem is not None
+        rate = totals["escalations"] / totals["turns"]
+    metrics.inc("assistant_tool_selections_total", model=tool_model(), result="escalated" if problem else "ok")
+    logger.info("tool_selection escalated for %.0f%% of turns", 100 * rate)
+    return message, tool_calls or [], problem is not None
+
+
+def stats():
+    # stage -> requests, mean latency in seconds, total cost in dollars, and for tool selection the escalation rate.
+    with _lock:
+        return {
+            stage: {
+                "requests": totals["requests"],
+                "mean_seconds": totals["seconds"] / totals["requests"] if totals["requests"] else 0.0,
+                "cost": totals["cost"],
+                **({"escalation_rate": totals["escalations"] / totals["turns"]} if totals["turns"] else {}),
+            }
+            for stage, totals in _stages.items()
+        }
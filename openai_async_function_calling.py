@@ -0,0 +1,318 @@
+# --------------------------------------------------------------
+# Import Modules
+# --------------------------------------------------------------
+
+import asyncio
+import contextvars
+import json
+import os
+import time
+
+import logging
+
+from dotenv import load_dotenv
+
+import completion_cache
+import forecast
+import http_transport
+from message_records import compact, tool_result
+from metrics import metrics, start_from_env
+from tool_executor import ERROR_PREFIX
+from tool_registry import ToolRegistry
+
+
+# --------------------------------------------------------------
+# The same weather assistant as openai_function_calling.py, but async
+#  -    openai_function_calling.py waits on every network call: the two OpenAI
+#       requests, the Open-Meteo requests, even input(). One process can only
+#       ever help one person with one question at a time.
+#  -    here every network call is awaited instead, using AsyncOpenAI and a
+#       shared, connection-pooled httpx.AsyncClient for the weather tools. While
+#       one conversation waits on the network, the event loop gets on with the
+#       others, so one process can drive hundreds of them at once.
+#  -    answer() is one full turn (tool selection, tool calls, final answer) and
+#       can be awaited from anywhere; main() is the usual input() loop around it.
+# --------------------------------------------------------------
+
+# One client is shared by every conversation, so its connections to Open-Meteo
+# are reused instead of opening a new one for every tool call. It uses the same
+# timeouts and retry policy as the sync scripts (see http_transport.py).
+def make_http_client():
+    return http_transport.make_async_client()
+
+
+async def fetch_many(http, points):
+    # One request for every point, like forecast.fetch_many().
+    response = await http_transport.async_get(http, forecast.FORECAST_URL, params=forecast.forecast_params(points))
+    response.raise_for_status()
+    return forecast.parse_currents(response.json(), len(points))
+
+
+async def fetch_current(http, latitude, longitude):
+    return (await fetch_many(http, [(latitude, longitude)]))[0]
+
+
+async def fetch_hourly(http, latitude, longitude, days):
+    response = await http_transport.async_get(
+        http, forecast.FORECAST_URL, params=forecast.hourly_params(latitude, longitude, days))
+    response.raise_for_status()
+    return response.json()['hourly']
+
+
+# Requests to Open-Meteo in progress, keyed by the (latitude, longitude) asked for, shared
+# by every conversation on the event loop (see forecast._inflight).
+_inflight = {}
+# The tasks running those requests; the event loop only keeps weak references to tasks.
+_fetches = set()
+
+
+def fetch_shared(http, points):
+    # Same as forecast.fetch_shared(), on the event loop: returns a future per point,
+    # reusing requests already in progress and sending the rest forecast.bulk_size() per request.
+    futures, mine = [], []
+    for point in points:
+        future = _inflight.get(point)
+        if future is None:
+            future = _inflight[point] = asyncio.get_running_loop().create_future()
+            mine.append((point, future))
+        futures.append(future)
+
+    size = forecast.bulk_size()
+    for i in range(0, len(mine), size):
+        task = asyncio.ensure_future(_fetch_chunk(http, mine[i:i + size]))
+        _fetches.add(task)
+        task.add_done_callback(_fetches.discard)
+    return futures
+
+
+async def _fetch_chunk(http, chunk):
+    try:
+        currents = await fetch_many(http, [point for point, _ in chunk])
+    except Exception as e:
+        for _, future in chunk:
+            future.set_exception(e)
+    else:
+        for (_, future), current in zip(chunk, currents):
+            future.set_result(current)
+    finally:
+        for point, future in chunk:
+            # Only if we were cancelled: don't leave anyone waiting forever.
+            future.cancel()
+            del _inflight[point]
+
+
+# --------------------------------------------------------------
+# Sample function code stored in your local machine
+#  -    a Turn holds the forecasts for one question. Just like forecast.get_current(),
+#       each (latitude, longitude) is fetched once per turn and shared between
+#       get_weather and get_wind_speed, and recent results come from the same
+#       forecast cache the sync scripts use.
+#  -    call_tools() hands the Turn every place the tool calls ask about before
+#       running them, so they are all fetched together (see forecast.prefetch()).
+#  -    the tools find the Turn for the conversation they belong to through the
+#       current_turn context variable, which answer() sets. Each conversation
+#       runs in its own task, so each one sees its own Turn.
+# --------------------------------------------------------------
+
+class Turn:
+    def __init__(self, http):
+        self.http = http
+        self._forecasts = {}
+
+    def prefetch(self, points):
+        # Starts getting every point this turn doesn't have yet: cached ones right away,
+        # the rest in as few requests as possible.
+        cache = forecast.get_cache()
+        missing = []
+        for point in dict.fromkeys(points):
+            if point in self._forecasts:
+                continue
+            current = cache.get(*point) if cache.ttl > 0 else None
+            if current is None:
+                missing.append(point)
+            else:
+                self._forecasts[point] = asyncio.get_running_loop().create_future()
+                self._forecasts[point].set_result(current)
+
+        # Fetch the grid points themselves, so every caller that snaps to one gets the same answer.
+        keys = [cache.snap(*point) if cache.ttl > 0 else point for point in missing]
+        for point, shared in zip(missing, fetch_shared(self.http, keys)):
+            self._forecasts[point] = asyncio.ensure_future(self._remember(point, shared))
+
+    async def get_current(self, latitude, longitude):
+        key = (latitude, longitude)
+        if key not in self._forecasts:
+            self.prefetch([key])
+        # shield() so a tool call that times out doesn't cancel the fetch for the other one sharing it.
+        return await asyncio.shield(self._forecasts[key])
+
+    async def _remember(self, point, shared):
+        current = await shared
+        cache = forecast.get_cache()
+        if cache.ttl > 0:
+            cache.put(*point, current)
+        return current
+
+
+current_turn = contextvars.ContextVar("current_turn")
+
+registry = ToolRegistry()
+
+@registry.tool("Get current temperature for provided coordinates in celsius.")
+async def get_weather(latitude: float, longitude: float):
+    return (await current_turn.get().get_current(latitude, longitude))['temperature_2m']
+
+@registry.tool("Get current wind speed for provided coordinates in km/h.")
+async def get_wind_speed(latitude: float, longitude: float):
+    return (await current_turn.get().get_current(latitude, longitude))['wind_speed_10m']
+
+@registry.tool("Get a summary of the hourly forecast for provided coordinates, for today and the next days-1 days (at most 3): "
+                "temperature in celsius, relative humidity in %, wind speed in km/h, each with its min, max, mean, "
+                "peak hour, trend and part-of-day means. Use it for questions about later today or the coming days.")
+async def get_forecast_summary(latitude: float, longitude: float, days: int):
+    # Same as forecast.get_summary(), with the fetch on the event loop.
+    import forecast_summary
+
+    days = max(1, min(days, forecast_summary.MAX_DAYS))
+    return forecast_summary.summarize(await fetch_hourly(current_turn.get().http, latitude, longitude, days), days)
+
+
+# --------------------------------------------------------------
+# Define function definition for OpenAI model to use
+# --------------------------------------------------------------
+
+# Built once by the registry from get_weather and get_wind_speed above.
+tools = registry.tools
+
+
+# --------------------------------------------------------------
+# One turn: tool selection, tool calls, final answer
+# --------------------------------------------------------------
+
+async def run_tool_call(tool_call, timeout):
+    name = tool_call.function.name
+    try:
+        with metrics.timer("assistant_tool_seconds", "tool", tool=name):
+            args = json.loads(tool_call.function.arguments)
+            # registry.call() checks the arguments and hands back the tool's coroutine.
+            content = str(await asyncio.wait_for(registry.call(name, args), timeout))
+    except asyncio.TimeoutError:
+        content = f"{ERROR_PREFIX}{name} did not finish within {timeout:g} seconds."
+    except Exception as e:
+        content = f"{ERROR_PREFIX}{name} failed: {e}"
+    return tool_result(tool_call.id, content)
+
+
+def normalize_what_they_want(what_they_want):
+    # Same rule as the input() prompt in openai_function_calling.py.
+    what_they_want = (what_they_want or "").strip().lower()
+    if what_they_want == "both" or what_they_want not in ["temperature", "wind speed", "both", "later today"]:
+        what_they_want = "temperature and wind speed"
+    return what_they_want
+
+
+def question(city, what_they_want):
+    # "later today" is left to the model, which answers it with get_forecast_summary.
+    if what_they_want == "later today":
+        return f"What's the weather like in {city} later today?"
+    return f"What's the {what_they_want} like in {city} today?"
+
+
+# call_tools() is the first half of a turn (tool selection and tool calls), answer() the
+# whole turn. openai_server.py uses call_tools() on its own so it can stream the answer.
+# If a timings dict is passed in, they fill it with how many seconds each stage
+# took: "tool_selection", "tools" and "answer".
+async def call_tools(client, http, city, what_they_want, timeout=None, timings=None):
+    # Returns the names of the functions called, and the messages to ask for the answer with.
+    if timeout is None:
+        timeout = float(os.getenv("TOOL_TIMEOUT", "10"))
+    if timings is None:
+        timings = {}
+
+    messages = [{"role": "user", "content": question(city, what_they_want)}]
+
+    # Let OpenAI model decide what function to call
+    started = time.perf_counter()
+    completion = await completion_cache.acreate(
+        client,
+        "tool_selection",
+        model="gpt-4o",
+        messages=messages,
+        tools=tools,
+    )
+    message = completion.choices[0].message
+    tool_calls = message.tool_calls or []
+    messages.append(compact(message))
+    timings["tool_selection"] = time.perf_counter() - started
+
+    # Run every tool call at the same time; gather() keeps them in tool_call order.
+    started = time.perf_counter()
+    turn = Turn(http)
+    current_turn.set(turn)
+    # Every place the tool calls ask about is fetched up front, together (see forecast.prefetch()).
+    turn.prefetch(forecast.tool_call_points(tool_calls))
+    messages.extend(await asyncio.gather(*(run_tool_call(tool_call, timeout) for tool_call in tool_calls)))
+    timings["tools"] = time.perf_counter() - started
+    return [tool_call.function.name for tool_call in tool_calls], messages
+
+
+async def answer(client, http, city, what_they_want, timeout=None, timings=None):
+    if timings is None:
+        timings = {}
+    names, messages = await call_tools(client, http, city, what_they_want, timeout, timings)
+
+    # Supply OpenAI model with results and get the response in Natural Language
+    started = time.perf_counter()
+    completion_2 = await completion_cache.acreate(
+        client,
+        "answer",
+        model="gpt-4o",
+        messages=messages,
+        tools=tools,
+    )
+    timings["answer"] = time.perf_counter() - started
+    return names, completion_2.choices[0].message.content
+
+
+# --------------------------------------------------------------
+# Sample user request
+# --------------------------------------------------------------
+
+async def main():
+    load_dotenv()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+    start_from_env()
+
+    # openai and httpx take a while to import, so the clients are only created once
+    # there is a question to answer, and the first prompt shows up right away.
+    client = http = None
+    try:
+        while True:
+            # input() blocks, so it runs on a worker thread and the event loop stays free.
+            city = (await asyncio.to_thread(input, "Enter the city you'd like to learn more about for today (or type 'exit' to quit): ")).strip()
+            if city.lower() == "exit":
+                break
+
+            what_they_want = normalize_what_they_want(await asyncio.to_thread(input, "What would you like to know about the city? (temperature/wind speed/both/later today): "))
+
+            if client is None:
+                import openai
+                client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+                http = make_http_client()
+
+            names, content = await answer(client, http, city, what_they_want)
+
+            print("\n\n===============================\n\n")
+            print(f"Based off user input, the function(s) you should call are:")
+            for name in names:
+                print(f"{name}()")
+            print("\n\n===============================\n\n")
+
+            print(content)
+    finally:
+        if client is not None:
+            await http.aclose()
+            await client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
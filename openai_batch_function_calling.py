@@ -0,0 +1,191 @@
+# --------------------------------------------------------------
+# Batch mode: answer a whole file of weather questions
+#  -    runs the same flow as openai_function_calling.py (tool selection ->
+#       tool calls -> answer) for every line of a JSONL file, instead of
+#       asking for one city at a time with input(). Each input line looks like
+#           {"id": "job-1", "city": "Chicago", "what_they_want": "wind speed"}
+#       ("id" is optional; the line number is used if it is missing).
+#  -    jobs are read from the file as they are needed, never all at once, and
+#       at most --concurrency of them are in flight at the same time (they use
+#       openai_async_function_calling.answer() on one event loop).
+#  -    each finished job is written to the output JSONL straight away. The
+#       output file doubles as the checkpoint: run the same command again and
+#       every job already in it is skipped. Jobs that failed go to
+#       <output>.errors.jsonl and are tried again on the next run. So do input
+#       lines that aren't a JSON object, with their line number; the rest of
+#       the file still runs.
+#  -    every OpenAI request goes in the batch lane of the rate limit scheduler
+#       (see rate_limit.py), behind any interactive requests in the same process.
+#  -    at the end it prints throughput (jobs/s) and how long each stage took.
+#
+#  python openai_batch_function_calling.py jobs.jsonl results.jsonl --concurrency 32
+# --------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+import openai_async_function_calling as flow
+import rate_limit
+from metrics import start_from_env
+
+
+STAGES = ["tool_selection", "tools", "answer", "total"]
+
+
+def read_done(path):
+    # Ids of the jobs that already have a result from an earlier run.
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["id"])
+                except (ValueError, KeyError, TypeError):
+                    # The last line may be cut short if the previous run was killed mid-write.
+                    continue
+    return done
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Batch:
+    def __init__(self, output_path, concurrency):
+        self.output_path = output_path
+        self.errors_path = output_path + ".errors.jsonl"
+        self.concurrency = concurrency
+        self.latencies = {stage: [] for stage in STAGES}
+        self.succeeded = 0
+        self.failed = 0
+        self.bad_lines = 0
+
+    def read_jobs(self, path, done, errors):
+        with open(path) as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    job = json.loads(line)
+                    if not isinstance(job, dict):
+                        raise ValueError("not a JSON object")
+                    # The ids go in a set (see read_done()), and bool is an int too.
+                    if "id" in job and (not isinstance(job["id"], (str, int)) or isinstance(job["id"], bool)):
+                        raise ValueError('"id" must be a string or an integer')
+                except ValueError as e:
+                    # One bad line shouldn't cost the rest of the file.
+                    self.bad_lines += 1
+                    errors.write(json.dumps({"line": line_number, "error": f"{type(e).__name__}: {e}", "text": line}) + "\n")
+                    errors.flush()
+                    continue
+                job.setdefault("id", line_number)
+                if job["id"] not in done:
+                    yield job
+
+    async def run(self, client, input_path, done):
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        with open(self.output_path, "a") as output, open(self.errors_path, "a") as errors:
+            async with flow.make_http_client() as http:
+                workers = [asyncio.create_task(self._worker(queue, client, http, output, errors))
+                           for _ in range(self.concurrency)]
+                # The bounded queue means we only read ahead a little of the input file.
+                for job in self.read_jobs(input_path, done, errors):
+                    await queue.put(job)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+
+    async def _worker(self, queue, client, http, output, errors):
+        # Each worker is its own task, so this only changes the lane for this worker's requests.
+        rate_limit.current_lane.set("batch")
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+
+            timings = {}
+            started = time.perf_counter()
+            try:
+                functions, content = await flow.answer(
+                    client, http, job["city"], flow.normalize_what_they_want(job.get("what_they_want")), timings=timings)
+            except Exception as e:
+                self.failed += 1
+                errors.write(json.dumps({"id": job["id"], "city": job.get("city"), "error": f"{type(e).__name__}: {e}"}) + "\n")
+                errors.flush()
+                continue
+            timings["total"] = time.perf_counter() - started
+
+            for stage in STAGES:
+                self.latencies[stage].append(timings[stage])
+            self.succeeded += 1
+            output.write(json.dumps({
+                "id": job["id"],
+                "city": job["city"],
+                "what_they_want": job.get("what_they_want"),
+                "functions": functions,
+                "answer": content,
+                "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+            }) + "\n")
+            # Flush every line, so a crash never loses more than the job in progress.
+            output.flush()
+
+    def report(self, elapsed):
+        print(f"{self.succeeded} jobs done, {self.failed} failed in {elapsed:.1f}s "
+              f"({self.succeeded / elapsed if elapsed else 0:.2f} jobs/s)")
+        if self.bad_lines:
+            print(f"  {self.bad_lines} input lines could not be read, see {self.errors_path}")
+        if not self.succeeded:
+            return
+        for stage in STAGES:
+            values = self.latencies[stage]
+            print(f"  {stage:>14}: mean {sum(values) / len(values) * 1000:7.0f} ms   "
+                  f"p50 {percentile(values, 0.5) * 1000:7.0f} ms   p95 {percentile(values, 0.95) * 1000:7.0f} ms")
+
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return value
+
+
+async def main():
+    # Loaded first, so BATCH_CONCURRENCY can come from .env too.
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of weather questions.")
+    parser.add_argument("input", help="JSONL file with one {\"city\": ..., \"what_they_want\": ...} job per line")
+    parser.add_argument("output", help="JSONL file to append results to (also used to resume)")
+    parser.add_argument("--concurrency", type=positive_int, default=os.getenv("BATCH_CONCURRENCY", "16"))
+    args = parser.parse_args()
+
+    # Imported here so --help doesn't wait on it.
+    import openai
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+    start_from_env()
+    client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    done = read_done(args.output)
+    if done:
+        print(f"Resuming: skipping {len(done)} jobs already in {args.output}")
+
+    batch = Batch(args.output, args.concurrency)
+    started = time.perf_counter()
+    await batch.run(client, args.input, done)
+    batch.report(time.perf_counter() - started)
+
+    await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
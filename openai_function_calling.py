@@ -3,125 +3,183 @@
 # --------------------------------------------------------------
 
 import os
-import json
-import openai
+import sys
+import threading
+import logging
+import time
 from dotenv import load_dotenv
-import requests
+from forecast import get_cache, get_current, get_summary, start_prefetch, start_turn, tool_call_points
+from tool_executor import collect, run_tool_calls, submit
+from streaming import format_timing, stream_completion, stream_tool_calls, stream_tool_calls_enabled, streaming_enabled
+from tool_registry import ToolRegistry
+import fast_answer
+import direct_tools
+import gazetteer
+import speculation
+import completion_cache
+import model_routing
+import prewarm
+from metrics import start_from_env
+from message_records import compact
 
 
 # --------------------------------------------------------------
 # Sample function code stored in your local machine
-#  -    there are two functions, get_weather and get_wind_speed, and 
-#       call_functions that determine which function to call based on
-#       OpenAI's response
+#  -    there are three functions, get_weather, get_wind_speed and
+#       get_forecast_summary, and call_functions that determine which function
+#       to call based on OpenAI's response
+#  -    both functions read from the same forecast (see forecast.py), so
+#       asking for temperature and wind speed only hits Open-Meteo once,
+#       and asking about the same city again soon after is served from cache
+#  -    @registry.tool(...) registers each function as a tool (see tool_registry.py):
+#       its JSON schema is generated from the type hints, so we don't have to
+#       write it out by hand below
 # --------------------------------------------------------------
 
-def get_weather(latitude, longitude):
-    response = requests.get(f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,wind_speed_10m&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m")
-    data = response.json()
-    return data['current']['temperature_2m']
+registry = ToolRegistry()
 
-def get_wind_speed(latitude, longitude):
-    response = requests.get(f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,wind_speed_10m&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m")
-    data = response.json()
-    return data['current']['wind_speed_10m']
+@registry.tool("Get current temperature for provided coordinates in celsius.")
+def get_weather(latitude: float, longitude: float):
+    return get_current(latitude, longitude)['temperature_2m']
+
+@registry.tool("Get current wind speed for provided coordinates in km/h.")
+def get_wind_speed(latitude: float, longitude: float):
+    return get_current(latitude, longitude)['wind_speed_10m']
+
+# For "will it get windier this afternoon?": a short summary of the hourly forecast
+# (see forecast_summary.py), not the raw hourly numbers, which would take thousands of tokens.
+@registry.tool("Get a summary of the hourly forecast for provided coordinates, for today and the next days-1 days (at most 3): "
+                "temperature in celsius, relative humidity in %, wind speed in km/h, each with its min, max, mean, "
+                "peak hour, trend and part-of-day means. Use it for questions about later today or the coming days.")
+def get_forecast_summary(latitude: float, longitude: float, days: int):
+    return get_summary(latitude, longitude, days)
 
 # We need this function because of how OpenAI returns "function calls." If you remember from the last part,
 # the response contains a list of "tool call" objects that each have a name and arguments. We were able to
 # ignore this last time since we only had one function. But now since we have multiple functions, we have to 
 # figure out what function OpenAI wants to call based on the tool call object's name.
+# The registry keeps the functions in a dict by name, and checks the arguments before calling the function.
 def call_function(name, args):
-    if name == "get_weather":
-        return get_weather(**args)
-    if name == "get_wind_speed":
-        return get_wind_speed(**args)
+    return registry.call(name, args)
 
 # --------------------------------------------------------------
-# Load OpenAI API Token From the .env File
+# OpenAI client
+#  -    importing openai takes most of a second, so it is imported and the
+#       client created the first time a question is asked, not when this
+#       module is imported. That way the first prompt shows up right away, and
+#       the tools above can be imported elsewhere without starting anything.
 # --------------------------------------------------------------
 
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+_client = None
+# prewarm.py creates the client in the background while the first prompt is up.
+_client_lock = threading.Lock()
+
 
-client = openai.OpenAI()
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            import openai
+            _client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
 
 
 # --------------------------------------------------------------
-# Define function definition for OpenAI model to use. Notice there are two functions now
+# Define function definition for OpenAI model to use. Notice there are three functions now
 # --------------------------------------------------------------
 
-tools = [{
-    "type": "function",
-    "function": {
-        "name": "get_weather",
-        "description": "Get current temperature for provided coordinates in celsius.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "latitude": {"type": "number"},
-                "longitude": {"type": "number"}
-            },
-            "required": ["latitude", "longitude"],
-            "additionalProperties": False
-        },
-        "strict": True
-    }
-},
-{
-    "type": "function",
-    "function": {
-        "name": "get_wind_speed",
-        "description": "Get current wind speed for provided coordinates in km/h.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "latitude": {"type": "number"},
-                "longitude": {"type": "number"}
-            },
-            "required": ["latitude", "longitude"],
-            "additionalProperties": False
-        },
-        "strict": True
-    }
-}]
+# The registry built these from get_weather, get_wind_speed and get_forecast_summary above. They are built once,
+# here, and the same list is reused for every request.
+tools = registry.tools
 
 # --------------------------------------------------------------
-# Sample user request
+# One question, from picking the functions to the answer
+#  -    main() below asks for the city and what they want and calls turn();
+#       benchmarks/bench_flows.py calls the same turn() without the input()
+#  -    call start_turn() first. early is prewarm.look_up(city), if it was
+#       started; everything is printed to out
 # --------------------------------------------------------------
 
-while True:
-    city = input("Enter the city you'd like to learn more about for today (or type 'exit' to quit): ").strip()
-    if city.lower() == "exit":
-        break
-
-    what_they_want = input("What would you like to know about the city? (temperature/wind speed/both): ").strip().lower()
-    if what_they_want == "both" or what_they_want not in ["temperature", "wind speed", "both"]:
-        what_they_want = "temperature and wind speed"
-
-    messages = [{"role": "user", "content": f"What's the {what_they_want} like in {city} today?"}]
+def turn(client, city, what_they_want, early=None, out=sys.stdout):
+    # Returns the answer.
+    # "later today" is left to the model below (direct_tools.py doesn't plan it), which can
+    # answer it with get_forecast_summary.
+    if what_they_want == "later today":
+        messages = [{"role": "user", "content": f"What's the weather like in {city} later today?"}]
+    else:
+        messages = [{"role": "user", "content": f"What's the {what_they_want} like in {city} today?"}]
 
     # --------------------------------------------------------------
     # Let OpenAI model decide what function to call
     # --------------------------------------------------------------
 
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        tools=tools,
-    )
-
-    # print(completion)
-    # print("\n\n\n===============================\n\n\n")
-    # print(completion.choices[0].message.tool_calls)
-
-    print("\n\n===============================\n\n")
-
-    print(f"Based off user input, the function(s) you should call are:")
-    for tool_call in completion.choices[0].message.tool_calls:
+    # If we can find the city in our local city list (see gazetteer.py), we already know its
+    # coordinates, and what_they_want tells us which functions to call. So we can make the
+    # tool calls ourselves (see direct_tools.py) and skip this first request to OpenAI.
+    # (With PREWARM=1 the lookup, and the forecast fetch for the place, started after the first prompt.)
+    place, guess = early.result() if early is not None else (gazetteer.resolve(city), None)
+    plan = direct_tools.plan(what_they_want, place.latitude, place.longitude) if place else None
+    started = None
+    if plan is not None:
+        assistant_message, tool_calls = plan
+    else:
+        # While OpenAI works out the coordinates, start fetching the forecast for where we
+        # guess it will point (see speculation.py). If it points somewhere else, it's thrown away.
+        if early is None:
+            guess = speculation.start(city)
+
+        # The tools are picked by a cheap model (TOOL_MODEL), and if its tool calls don't check out,
+        # by a stronger one (ESCALATION_MODEL) instead (see model_routing.py).
+        if stream_tool_calls_enabled():
+            # With STREAM_TOOL_CALLS=1, each tool call starts running as soon as OpenAI has finished
+            # writing it, while it is still writing the next one (see streaming.stream_tool_calls()).
+            started = {}
+            used = False
+
+            def start_tool_call(index, tool_call):
+                nonlocal used
+                # One the cheap model got wrong waits for the escalation below.
+                if model_routing.can_escalate() and model_routing.check([tool_call], registry) is not None:
+                    return
+                used = speculation.adopt(guess, [tool_call]) or used
+                started[index] = submit(tool_call, call_function)
+
+            began = time.perf_counter()
+            assistant_message, tool_calls, usage = stream_tool_calls(
+                client,
+                start_tool_call,
+                stage="tool_selection",
+                model=model_routing.tool_model(),
+                messages=messages,
+                tools=tools,
+            )
+            model_routing.record("tool_selection", model_routing.tool_model(), time.perf_counter() - began, usage)
+            assistant_message, tool_calls, escalated = model_routing.escalate(
+                client, registry, messages, assistant_message, tool_calls)
+            if escalated:
+                # The stronger model's tool calls run below, like non-streamed ones.
+                started = None
+                speculation.use(guess, city, tool_calls)
+            else:
+                speculation.finish(guess, city, tool_calls, used)
+        else:
+            # Like client.chat.completions.create(), except that with COMPLETION_CACHE=1 a question
+            # we've seen before is answered from cache (see completion_cache.py).
+            assistant_message, tool_calls, _ = model_routing.select_tools(client, registry, messages)
+
+            # Hand the speculative fetch to the tool calls that point where we guessed.
+            speculation.use(guess, city, tool_calls)
+
+    print("\n\n===============================\n\n", file=out)
+
+    if plan is not None:
+        print(f"Found {place.name}, {place.country} in the local city list, so we skipped asking OpenAI.", file=out)
+    print(f"Based off user input, the function(s) you should call are:", file=out)
+    for tool_call in tool_calls:
         name = tool_call.function.name
-        print(f"{name}()")
+        print(f"{name}()", file=out)
 
-    print("\n\n===============================\n\n")
+    print("\n\n===============================\n\n", file=out)
 
 
     # --------------------------------------------------------------
@@ -130,23 +188,23 @@ while True:
 
     # Just like before, we will use the result of our function call to make another request to OpenAI.
     # We again append the result of our first request to the list—this is what OpenAI sent us back in response to our first question.
-    messages.append(completion.choices[0].message)
-
-    # Since we can expect multiple tool calls now, we now loop through the list of tool calls and call each function.
-    for tool_call in completion.choices[0].message.tool_calls:
-        # Here, we take the relevant information from the tool call object
-        name = tool_call.function.name
-        args = json.loads(tool_call.function.arguments)
-
-        # And then use it to call the function
-        result = call_function(name, args)
-
-        # Finally, we add a message with the result for that function call.
-        messages.append({
-            "role": "tool",
-            "tool_call_id": tool_call.id,
-            "content": str(result)
-        })
+    # compact() keeps just the role, content and tool calls of it (see message_records.py).
+    messages.append(compact(assistant_message))
+
+    # Since we can expect multiple tool calls now, we run all of them at the same time (see tool_executor.py).
+    # Each one turns into a "tool" message with its result, in the same order as the tool calls. If one of
+    # them fails or takes too long, its message says so instead, and the rest of the turn carries on.
+    # Every place they ask about is fetched in one request to Open-Meteo, started before the tool calls,
+    # which wait on it; so a slow Open-Meteo costs at most TOOL_TIMEOUT too (see forecast.start_prefetch()).
+    # Tool calls that were started while streaming are already running; we just wait for them,
+    # and start any that were held back.
+    if started is not None:
+        tool_messages = collect(tool_calls, [started.get(index) or submit(tool_call, call_function)
+                                             for index, tool_call in enumerate(tool_calls)])
+    else:
+        start_prefetch(tool_call_points(tool_calls))
+        tool_messages = run_tool_calls(tool_calls, call_function)
+    messages.extend(tool_messages)
 
     # print("\n\nMessages:", messages)
 
@@ -157,12 +215,100 @@ while True:
     # To end, we make another request to OpenAI with the updated messages list.
     # This is the same thing we did before, except we are now able to supply OpenAI with the 
     # results of multiple function calls, not just a single one.
-    completion_2 = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        tools=tools,
-    )
+    #
+    # With FAST_ANSWERS=1, simple questions ("temperature", "wind speed" or both) whose tools all
+    # worked are answered right here from a template instead (see fast_answer.py), which skips
+    # the second request to OpenAI altogether.
+    fast = fast_answer.render(city, what_they_want, tool_calls, tool_messages)
+    if fast is not None:
+        print(fast, file=out)
+        return fast
+    elif streaming_enabled():
+        # Print the answer word by word as OpenAI writes it (see streaming.py), instead of
+        # waiting for the whole thing.
+        answer = stream_completion(
+            client,
+            out=out,
+            stage="answer",
+            model=model_routing.answer_model(),
+            messages=messages,
+            tools=tools,
+        )
+        model_routing.record("answer", model_routing.answer_model(), answer.total_time, answer.usage)
+        print(format_timing(answer), file=out)
+        return answer.content
+    else:
+        completion_2 = model_routing.create(
+            client,
+            "answer",
+            model_routing.answer_model(),
+            messages=messages,
+            tools=tools,
+        )
+
+        # print("\n\n\n===============================\n\n\n")
+
+        print(completion_2.choices[0].message.content, file=out)
+        return completion_2.choices[0].message.content
+
+
+# --------------------------------------------------------------
+# Sample user request
+# --------------------------------------------------------------
 
-    # print("\n\n\n===============================\n\n\n")
+def main():
+    # --------------------------------------------------------------
+    # Load OpenAI API Token From the .env File
+    # --------------------------------------------------------------
 
-    print(completion_2.choices[0].message.content)
\ No newline at end of file
+    load_dotenv()
+
+    # Set LOG_LEVEL=INFO in .env to see how long each weather request takes.
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+
+    # METRICS_PORT / METRICS_TRACE_PATH / PROFILE in .env export per-stage timings (see metrics.py).
+    start_from_env()
+
+    while True:
+        # While we wait for them to type, the connections to OpenAI and Open-Meteo are opened
+        # and kept open, so the turn doesn't start by setting them up again (see prewarm.py).
+        with prewarm.while_waiting(get_client):
+            city = input("Enter the city you'd like to learn more about for today (or type 'exit' to quit): ").strip()
+        if city.lower() == "exit":
+            break
+
+        # Forget the forecasts fetched for the previous question.
+        start_turn()
+
+        # We already know the city, so start looking it up while they answer the next question.
+        early = prewarm.look_up(city)
+
+        with prewarm.while_waiting(get_client):
+            what_they_want = input("What would you like to know about the city? (temperature/wind speed/both/later today): ").strip().lower()
+        if what_they_want == "both" or what_they_want not in ["temperature", "wind speed", "both", "later today"]:
+            what_they_want = "temperature and wind speed"
+
+        turn(get_client(), city, what_they_want, early)
+
+    # Show how well the forecast cache did, so we can tell if it is big enough.
+    stats = get_cache().stats()
+    print(f"Forecast cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} entries")
+    if completion_cache.get_cache() is not None:
+        stats = completion_cache.get_cache().stats()
+        print(f"Completion cache: {stats['hits']} hits, {stats['misses']} misses, {stats['bytes_saved']} bytes saved")
+    stats = speculation.stats()
+    if stats["hits"] or stats["misses"]:
+        print(f"Speculative forecasts: {stats['hits']} used, {stats['misses']} thrown away")
+    stats = fast_answer.stats()
+    if stats["hits"] or stats["misses"]:
+        print(f"Fast answers: {stats['hits']} of {stats['hits'] + stats['misses']} turns "
+              f"({stats['hit_rate']:.0%}) answered from a template")
+    # What each stage cost, so TOOL_MODEL / ANSWER_MODEL can be tuned.
+    for stage, stats in model_routing.stats().items():
+        escalated = f", {stats['escalation_rate']:.0%} escalated" if "escalation_rate" in stats else ""
+        print(f"{stage}: {stats['requests']} requests, {stats['mean_seconds'] * 1000:.0f} ms on average, "
+              f"${stats['cost']:.4f}{escalated}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+# --------------------------------------------------------------
+# The weather assistant as an HTTP service
+#  -    openai_function_calling.py helps one person per process, through
+#       input(). This serves the same assistant over HTTP instead, so a chat
+#       front end can send every user's questions to one process, and more
+#       processes can be started behind a load balancer as needed:
+#           POST /weather-ask   {"city": "Chicago", "what_they_want": "wind speed"}
+#           POST /chat          {"message": "Hi!", "session_id": "..."}  (session_id is optional)
+#           GET  /health        200 while serving, 503 once shutting down
+#           GET  /metrics       the numbers from metrics.py, for Prometheus
+#  -    everything runs on one asyncio event loop, using the async flow from
+#       openai_async_function_calling.py, so many sessions can wait on OpenAI
+#       and Open-Meteo at the same time without a thread or process each.
+#  -    add "stream": true to the request body (or send Accept: text/event-stream)
+#       and the answer comes back as server-sent events while it is written.
+#  -    requests wait in a queue for one of SERVER_CONCURRENCY workers. Once
+#       every worker is busy and SERVER_QUEUE_SIZE more requests are waiting,
+#       new ones are turned away right away with 503 and Retry-After instead of
+#       piling up.
+#  -    a client gets SERVER_READ_TIMEOUT seconds to send each request; one that
+#       takes longer (or sits idle between requests that long) is disconnected.
+#  -    /chat remembers each session's earlier turns, trimmed to CHAT_TOKEN_BUDGET
+#       (see conversation.py). Past SERVER_MAX_SESSIONS sessions, the least
+#       recently used are forgotten.
+#  -    on SIGTERM or Ctrl+C the server turns new requests away with 503 and
+#       reports itself unhealthy on /health (so a load balancer stops sending
+#       it traffic), finishes the requests it already has (for up to
+#       SERVER_SHUTDOWN_TIMEOUT seconds), and only then closes and exits.
+#
+#  python -m openai_server --port 8000
+# --------------------------------------------------------------
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import uuid
+from collections import OrderedDict, namedtuple
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+import conversation
+import openai_async_function_calling as flow
+from metrics import metrics, start_from_env
+from openai_simple_chat import SYSTEM_PROMPT
+from streaming import astream_completion
+
+
+logger = logging.getLogger("openai_server")
+
+# Requests with a bigger body are refused; a question is a few hundred bytes.
+MAX_BODY = 64 * 1024
+
+# What a session id sent by the client may look like.
+SESSION_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+Request = namedtuple("Request", ["method", "path", "headers", "body"])
+Session = namedtuple("Session", ["memory", "lock"])
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+# --------------------------------------------------------------
+# Just enough HTTP/1.1
+# --------------------------------------------------------------
+
+async def read_request(reader, timeout):
+    # Returns None when the client closed the connection between requests, or sent nothing for timeout seconds.
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "request headers too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+
+    if "transfer-encoding" in headers:
+        raise HTTPError(411, "send a Content-Length instead of a chunked body")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "bad Content-Length")
+    if length > MAX_BODY:
+        raise HTTPError(413, f"request body over {MAX_BODY} bytes")
+    try:
+        body = await asyncio.wait_for(reader.readexactly(length), timeout) if length else b""
+    except asyncio.TimeoutError:
+        raise HTTPError(408, f"request body not sent within {timeout:g} seconds")
+    return Request(method.upper(), urlsplit(target).path, headers, body)
+
+
+def _head(status, headers):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send(writer, status, data, content_type, keep_alive=True, headers=None):
+    writer.write(_head(status, {
+        "Content-Type": content_type,
+        "Content-Length": len(data),
+        "Connection": "keep-alive" if keep_alive else "close",
+        **(headers or {}),
+    }) + data)
+    await writer.drain()
+
+
+async def send_json(writer, status, payload, keep_alive=True, headers=None):
+    await send(writer, status, json.dumps(payload).encode(), "application/json", keep_alive, headers)
+
+
+def event(name, data):
+    # One server-sent event.
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+# --------------------------------------------------------------
+# Jobs: one request, waiting in the queue or being run by a worker
+#  -    the worker reports back through events: ("text", piece) for each piece
+#       of the answer as it is written, then ("done", result) or ("error", message)
+# --------------------------------------------------------------
+
+class Job:
+    def __init__(self, run):
+        self.run = run
+        self.events = asyncio.Queue()
+        self.task = None
+        self.abandoned = False
+
+    def emit(self, name, data):
+        self.events.put_nowait((name, data))
+
+    def cancel(self):
+        # The client went away: skip the job if it is still queued, stop it if it is running.
+        self.abandoned = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def result(self):
+        while True:
+            name, data = await self.events.get()
+            if name in ("done", "error"):
+                return name, data
+
+
+class Server:
+    def __init__(self, concurrency=64, queue_size=256, max_sessions=10000, shutdown_timeout=30.0, read_timeout=30.0):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue = asyncio.Queue()
+        self.max_sessions = max_sessions
+        self.shutdown_timeout = shutdown_timeout
+        self.read_timeout = read_timeout
+        self.sessions = OrderedDict()
+        self.draining = False
+        self.in_flight = 0
+        # Requests queued or being run. Counted here rather than by the queue's size, since an idle
+        # worker only takes its job off the queue the next time it gets to run.
+        self.admitted = 0
+        self.client = None
+        self.http = None
+        self._server = None
+        self._workers = []
+
+    async def start(self, host, port):
+        import openai
+
+        self.client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.http = flow.make_http_client()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        self._server = await asyncio.start_server(self._connection, host, port, backlog=1024)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def shutdown(self):
+        # Keep listening while draining, so /health can say so.
+        self.draining = True
+        try:
+            await asyncio.wait_for(self.queue.join(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("gave up on %d requests after %gs", self.in_flight + self.queue.qsize(),
+                           self.shutdown_timeout)
+        self._server.close()
+        await self._server.wait_closed()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        await self.http.aclose()
+        await self.client.close()
+
+    # ----------------------------------------------------------
+    # Workers
+    # ----------------------------------------------------------
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if not job.abandoned:
+                    self.in_flight += 1
+                    job.task = asyncio.create_task(self._run(job))
+                    try:
+                        # wait() rather than await, so a job cancelled by its client doesn't stop the worker.
+                        await asyncio.wait([job.task])
+                    except asyncio.CancelledError:
+                        job.task.cancel()
+                        raise
+                    finally:
+                        self.in_flight -= 1
+            finally:
+                self.admitted -= 1
+                self.queue.task_done()
+
+    async def _run(self, job):
+        try:
+            job.emit("done", await job.run(job))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("request failed")
+            metrics.inc("assistant_errors_total", stage="server")
+            job.emit("error", str(e))
+
+    # ----------------------------------------------------------
+    # Endpoints. Each checks the request body, then returns the coroutine
+    # function that does the work and any extra response headers.
+    # ----------------------------------------------------------
+
+    def weather_ask(self, body):
+        city = body.get("city")
+        if not isinstance(city, str) or not city.strip():
+            raise HTTPError(400, '"city" is required')
+        city = city.strip()
+        what_they_want = flow.normalize_what_they_want(body.get("what_they_want"))
+
+        async def run(job):
+            names, messages = await flow.call_tools(self.client, self.http, city, what_they_want)
+            job.emit("functions", names)
+            answer = await astream_completion(
+                self.client,
+                lambda text: job.emit("text", text),
+                stage="answer",
+                model="gpt-4o",
+                messages=messages,
+                tools=flow.tools,
+            )
+            return {"functions": names, "answer": answer.content}
+
+        return run, {}
+
+    def chat(self, body):
+        message = body.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPError(400, '"message" is required')
+        session_id = body.get("session_id") or uuid.uuid4().hex
+        # It is sent back in the X-Session-Id header, so nothing that could end or split a header line.
+        if not isinstance(session_id, str) or not SESSION_ID.fullmatch(session_id):
+            raise HTTPError(400, '"session_id" must be 1-64 letters, digits, "_" or "-"')
+
+        async def run(job):
+            session = self._session(session_id)
+            # One turn at a time per session, so two requests can't interleave their history.
+            async with session.lock:
+                messages = session.memory.prepare(message)
+                answer = await astream_completion(
+                    self.client,
+                    lambda text: job.emit("text", text),
+                    stage="chat",
+                    model="gpt-4o-mini",
+                    messages=messages,
+                )
+                session.memory.add_turn(message, answer.content)
+            return {"session_id": session_id, "answer": answer.content}
+
+        return run, {"X-Session-Id": session_id}
+
+    def _session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            memory = conversation.Conversation(
+                SYSTEM_PROMPT,
+                budget=int(os.getenv("CHAT_TOKEN_BUDGET", "2000")),
+                low_water=float(os.getenv("CHAT_LOW_WATER", "0.75")),
+            )
+            session = self.sessions[session_id] = Session(memory, asyncio.Lock())
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(session_id)
+        return session
+
+    # ----------------------------------------------------------
+    # Connections
+    # ----------------------------------------------------------
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.read_timeout)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                keep_alive = not self.draining and request.headers.get("connection", "").lower() != "close"
+                if not await self._respond(request, writer, keep_alive) or not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, request, writer, keep_alive):
+        # Returns False if the connection can't be used for another request.
+        if request.path == "/health":
+            await send_json(writer, 503 if self.draining else 200, {
+                "status": "draining" if self.draining else "ok",
+                "in_flight": self.in_flight,
+                "queued": self.queue.qsize(),
+                "sessions": len(self.sessions),
+            }, keep_alive)
+            return True
+        if request.path == "/metrics":
+            await send(writer, 200, metrics.prometheus_text().encode(), "text/plain; version=0.0.4", keep_alive)
+            return True
+
+        endpoints = {"/weather-ask": self.weather_ask, "/chat": self.chat}
+        try:
+            run, headers, stream = self._accept(request, endpoints)
+        except HTTPError as e:
+            # Any path can be asked for, and each label value is a new metric series; count the unknown ones together.
+            endpoint = request.path if request.path in endpoints else "other"
+            metrics.inc("assistant_server_requests_total", endpoint=endpoint, status=e.status)
+            await send_json(writer, e.status, {"error": str(e)}, keep_alive, e.headers)
+            return True
+
+        job = Job(run)
+        if self.admitted >= self.concurrency + self.queue_size:
+            metrics.inc("assistant_server_requests_total", endpoint=request.path, status=503)
+            await send_json(writer, 503, {"error": "server busy, try again shortly"}, keep_alive, {"Retry-After": "1"})
+            return True
+        self.admitted += 1
+        self.queue.put_nowait(job)
+        metrics.inc("assistant_server_requests_total", endpoint=request.path, status=200)
+
+        try:
+            if stream:
+                await self._stream(job, writer, headers)
+                return False
+            name, data = await job.result()
+            if name == "error":
+                await send_json(writer, 500, {"error": data}, keep_alive, headers)
+            else:
+                await send_json(writer, 200, data, keep_alive, headers)
+            return True
+        except BaseException:
+            job.cancel()
+            raise
+
+    def _accept(self, request, endpoints):
+        # Returns (the job's coroutine function, response headers, whether to stream),
+        # or raises HTTPError if the request can't be taken.
+        if request.path not in endpoints:
+            raise HTTPError(404, f"no endpoint {request.path}")
+        if request.method != "POST":
+            raise HTTPError(405, f"{request.path} only accepts POST", {"Allow": "POST"})
+        if self.draining:
+            raise HTTPError(503, "shutting down")
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "the body must be JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "the body must be a JSON object")
+        run, headers = endpoints[request.path](body)
+        stream = body.get("stream") is True or "text/event-stream" in request.headers.get("accept", "")
+        return run, headers, stream
+
+    async def _stream(self, job, writer, headers):
+        writer.write(_head(200, {
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "Connection": "close",
+            **headers,
+        }))
+        while True:
+            name, data = await job.events.get()
+            writer.write(event(name, data))
+            await writer.drain()
+            if name in ("done", "error"):
+                return
+
+
+# --------------------------------------------------------------
+# Run the server until SIGTERM or Ctrl+C
+# --------------------------------------------------------------
+
+async def serve(host, port, **settings):
+    server = Server(**settings)
+    host, port = await server.start(host, port)
+    print(f"Serving on http://{host}:{port}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    print("Shutting down, finishing the requests already in progress...")
+    await server.shutdown()
+
+
+def main():
+    # Loaded first, so SERVER_HOST and SERVER_PORT can come from .env too.
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Serve the weather assistant over HTTP.")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8000")))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+    start_from_env()
+
+    asyncio.run(serve(
+        args.host,
+        args.port,
+        concurrency=int(os.getenv("SERVER_CONCURRENCY", "64")),
+        queue_size=int(os.getenv("SERVER_QUEUE_SIZE", "256")),
+        max_sessions=int(os.getenv("SERVER_MAX_SESSIONS", "10000")),
+        shutdown_timeout=float(os.getenv("SERVER_SHUTDOWN_TIMEOUT", "30")),
+        read_timeout=float(os.getenv("SERVER_READ_TIMEOUT", "30")),
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,108 @@
 import os
-import openai
+import threading
 from dotenv import load_dotenv
+from streaming import format_timing, stream_completion, streaming_enabled
+import completion_cache
+import conversation
+import prewarm
+from metrics import start_from_env
 
 # --------------------------------------------------------------
-# Load OpenAI API Token From the .env File
+# OpenAI client
+#  -    created (and openai imported) the first time a question needs it, so
+#       the prompt shows up right away
 # --------------------------------------------------------------
 
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+_client = None
+# prewarm.py creates the client in the background while the first prompt is up.
+_client_lock = threading.Lock()
 
-client = openai.OpenAI()
 
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            import openai
+            _client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+
+# If you want to play around with this, you can try changing the system message to
+# see how the assistant's behavior changes.
+SYSTEM_PROMPT = "You are a helpful assistant."
+# SYSTEM_PROMPT = "You are an unhelpful assistant, and should give the wrong answer."
 
 # --------------------------------------------------------------
 # Ask ChatGPT Questions!
 # --------------------------------------------------------------
 
-while True:
-    user_input = input("Ask a question (or type 'exit' to quit): ").strip()
-    if user_input.lower() == "exit":
-        break
-
-    # This is the meat of our function and is where we actually call OpenAI's API
-    # to get a response to the user's question.
-
-    # This is a pretty simple example, but the main idea is that we can send messages
-    # with different roles to the API. The system message sets the behavior of the "assistant",
-    # while the user message is the actual question we want to ask.
-
-    # If you want to play around with this, you can try changing the system message to 
-    # see how the assistant's behavior changes.
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            # {"role": "system", "content": "You are an unhelpful assistant, and should give the wrong answer."},
-            {"role": "user", "content": user_input}
-        ]
-    )
-
-    print("\nResponse:\n")
-    print(completion.choices[0].message.content)
-    print("\n" + "-" * 50 + "\n")
\ No newline at end of file
+def main():
+    # --------------------------------------------------------------
+    # Load OpenAI API Token From the .env File
+    # --------------------------------------------------------------
+
+    load_dotenv()
+
+    # METRICS_PORT / METRICS_TRACE_PATH / PROFILE in .env export per-stage timings (see metrics.py).
+    start_from_env()
+
+    # By default every question is asked on its own. With CHAT_MEMORY=trim or CHAT_MEMORY=summarize,
+    # the assistant remembers earlier turns, within a token budget (see conversation.py).
+    memory = conversation.from_env(SYSTEM_PROMPT, get_client)
+
+    while True:
+        # While we wait for them to type, the connection to OpenAI is opened and kept open,
+        # so the answer doesn't start by setting it up again (see prewarm.py).
+        with prewarm.while_waiting(get_client, forecasts=False):
+            user_input = input("Ask a question (or type 'exit' to quit): ").strip()
+        if user_input.lower() == "exit":
+            break
+
+        # This is the meat of our function and is where we actually call OpenAI's API
+        # to get a response to the user's question.
+
+        # This is a pretty simple example, but the main idea is that we can send messages
+        # with different roles to the API. The system message sets the behavior of the "assistant",
+        # while the user message is the actual question we want to ask.
+        if memory is not None:
+            # The system message, a summary of older turns, the recent turns, and the new question.
+            messages = memory.prepare(user_input)
+        else:
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_input}
+            ]
+
+        print("\nResponse:\n")
+        if streaming_enabled():
+            # Print the answer as it is being written instead of waiting for all of it (see streaming.py).
+            # With COMPLETION_CACHE=1, a question asked before is answered from cache (see completion_cache.py).
+            answer = stream_completion(get_client(), stage="chat", model="gpt-4o-mini", messages=messages)
+            print(format_timing(answer))
+            content, usage = answer.content, answer.usage
+        else:
+            completion = completion_cache.create(
+                get_client(),
+                "chat",
+                model="gpt-4o-mini",
+                messages=messages
+            )
+            print(completion.choices[0].message.content)
+            content, usage = completion.choices[0].message.content, completion.usage
+
+        if memory is not None:
+            # Show how big the prompt was, so we can see the budget doing its job.
+            counted = sum(conversation.message_tokens(message) for message in messages)
+            reported = f"{usage.prompt_tokens} reported by OpenAI, " if usage is not None else ""
+            print(f"\n(prompt: {reported}~{counted} counted; {memory.evicted_turns} old turns trimmed so far)")
+            memory.add_turn(user_input, content)
+        print("\n" + "-" * 50 + "\n")
+
+    # How much the completion cache saved us (only when COMPLETION_CACHE=1).
+    if completion_cache.get_cache() is not None:
+        stats = completion_cache.get_cache().stats()
+        print(f"Completion cache: {stats['hits']} hits, {stats['misses']} misses, {stats['bytes_saved']} bytes saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,111 +3,164 @@
 # --------------------------------------------------------------
 
 import os
+import threading
+import logging
 import json
-import openai
 from dotenv import load_dotenv
-import requests
+from forecast import get_cache, get_current, start_turn
+from tool_registry import ToolRegistry
+import fast_answer
+import completion_cache
+import model_routing
+import prewarm
+from metrics import metrics, start_from_env
+from message_records import compact, tool_result
 
 
 # --------------------------------------------------------------
 # Sample function code stored in your local machine
+#  -    @registry.tool(...) turns get_weather into a tool OpenAI can call, and
+#       builds its JSON schema from the type hints (see tool_registry.py)
 # --------------------------------------------------------------
 
-def get_weather(latitude, longitude):
-    response = requests.get(f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,wind_speed_10m&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m")
-    data = response.json()
-    return data['current']['temperature_2m']
+registry = ToolRegistry()
+
+@registry.tool("Get current temperature for provided coordinates in celsius.")
+def get_weather(latitude: float, longitude: float):
+    # get_current() remembers recent forecasts (see forecast.py), so asking
+    # about the same city twice in a row only calls Open-Meteo once.
+    return get_current(latitude, longitude)['temperature_2m']
 
 # --------------------------------------------------------------
-# Load OpenAI API Token From the .env File
+# OpenAI client
+#  -    created (and openai imported) on first use rather than at import time,
+#       so the prompt shows up right away and get_weather can be imported on its own
 # --------------------------------------------------------------
 
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+_client = None
+# prewarm.py creates the client in the background while the first prompt is up.
+_client_lock = threading.Lock()
+
 
-client = openai.OpenAI()
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            import openai
+            _client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
 
 # --------------------------------------------------------------
 # Define function definition for OpenAI model to use
 # --------------------------------------------------------------
 
-tools = [{
-    "type": "function",
-    "function": {
-        "name": "get_weather",
-        "description": "Get current temperature for provided coordinates in celsius.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "latitude": {"type": "number"},
-                "longitude": {"type": "number"}
-            },
-            "required": ["latitude", "longitude"],
-            "additionalProperties": False
-        },
-        "strict": True
-    }
-}]
+# The registry built this from get_weather above, once, so every request reuses the same list.
+tools = registry.tools
 
 # --------------------------------------------------------------
 # Get user request
 # --------------------------------------------------------------
 
-while True:
-    user_input = input("Enter the city you'd like to know's weather for today (or type 'exit' to quit): ").strip()
-    if user_input.lower() == "exit":
-        break
-
-    messages = [{"role": "user", "content": f"What's the weather like in {user_input} today?"}]
-
-    # --------------------------------------------------------------
-    # Let OpenAI model decide what function to call
-    # --------------------------------------------------------------
-
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        tools=tools,
-        n=1,
-    )
-
-    print("\n\n===============================\n\n")
-
-    print(f"Based off user input, the function you should call is {completion.choices[0].message.tool_calls[0].function.name}()")
-
-    print("\n\n===============================\n\n")
-
-    # --------------------------------------------------------------
-    # Execute the local function code based on OpenAI's prediction
-    # --------------------------------------------------------------
-
-    # Since we created our input in such a way that we know we will get a tool_call in our response, we can access it in our response's message object.
-    tool_call = completion.choices[0].message.tool_calls[0]
-    args = json.loads(tool_call.function.arguments)
-
-    # At this point, args will be a dictionary with values corresponding to the parameters in the function we sent to OpenAI
-    result = get_weather(args["latitude"], args["longitude"])
-
+def main():
     # --------------------------------------------------------------
-    # Supply OpenAI model with results and print response for users in Natural Language
+    # Load OpenAI API Token From the .env File
     # --------------------------------------------------------------
 
-    # Now, we use the result of our function call to make another request to OpenAI.
-    # First, we append the result of our first request to the list—this is what OpenAI sent us back in response to our first question.
-    messages.append(completion.choices[0].message)
-    # Then, we append a message with the result for that function call.
-    messages.append({                               
-        "role": "tool",
-        "tool_call_id": tool_call.id,
-        "content": str(result)
-    })
-
-    # Finally, we make another request to OpenAI with the updated messages list.
-    # Here, we're basically asking OpenAI to answer our original question, but now it has the result of our function call to work with.
-    completion_2 = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        tools=tools,
-    )
-
-    print(completion_2.choices[0].message.content)
\ No newline at end of file
+    load_dotenv()
+
+    # Set LOG_LEVEL=INFO in .env to see how long each weather request takes.
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+
+    # METRICS_PORT / METRICS_TRACE_PATH / PROFILE in .env export per-stage timings (see metrics.py).
+    start_from_env()
+
+    while True:
+        # While we wait for them to type, the connections to OpenAI and Open-Meteo are opened
+        # and kept open, so the turn doesn't start by setting them up again (see prewarm.py).
+        with prewarm.while_waiting(get_client):
+            user_input = input("Enter the city you'd like to know's weather for today (or type 'exit' to quit): ").strip()
+        if user_input.lower() == "exit":
+            break
+
+        messages = [{"role": "user", "content": f"What's the weather like in {user_input} today?"}]
+
+        # Forget the forecasts fetched for the previous question.
+        start_turn()
+
+        # --------------------------------------------------------------
+        # Let OpenAI model decide what function to call
+        # --------------------------------------------------------------
+
+        # Same as client.chat.completions.create(), but with COMPLETION_CACHE=1 a city we've
+        # asked about before skips the request (see completion_cache.py). The tool is picked by a
+        # cheap model (TOOL_MODEL), or by a stronger one (ESCALATION_MODEL) if the cheap one gets
+        # it wrong (see model_routing.py).
+        assistant_message, tool_calls, _ = model_routing.select_tools(get_client(), registry, messages, n=1)
+        if not tool_calls:
+            # Neither model called the function (see model_routing.py), so there is nothing to look up.
+            print(assistant_message.content or "Sorry, I couldn't work out where that is.")
+            continue
+
+        print("\n\n===============================\n\n")
+
+        print(f"Based off user input, the function you should call is {tool_calls[0].function.name}()")
+
+        print("\n\n===============================\n\n")
+
+        # --------------------------------------------------------------
+        # Execute the local function code based on OpenAI's prediction
+        # --------------------------------------------------------------
+
+        # Since we created our input in such a way that we know we will get a tool_call in our response, we can access it in our response's message object.
+        tool_call = tool_calls[0]
+        args = json.loads(tool_call.function.arguments)
+
+        # At this point, args will be a dictionary with values corresponding to the parameters in the function we sent to OpenAI.
+        # The registry checks them against get_weather's signature before calling it.
+        with metrics.timer("assistant_tool_seconds", "tool", tool=tool_call.function.name):
+            result = registry.call(tool_call.function.name, args)
+
+        # --------------------------------------------------------------
+        # Supply OpenAI model with results and print response for users in Natural Language
+        # --------------------------------------------------------------
+
+        # Now, we use the result of our function call to make another request to OpenAI.
+        # First, we append the result of our first request to the list—this is what OpenAI sent us back in response to our first question.
+        # compact() keeps just the role, content and tool calls of it (see message_records.py).
+        messages.append(compact(assistant_message))
+        # Then, we append a message with the result for that function call.
+        messages.append(tool_result(tool_call.id, str(result)))
+
+        # With FAST_ANSWERS=1, we can answer "what's the weather like" ourselves from the temperature
+        # (see fast_answer.py) and skip the second request to OpenAI.
+        fast = fast_answer.render(user_input, "temperature", [tool_call], messages[-1:])
+        if fast is not None:
+            print(fast)
+        else:
+            # Finally, we make another request to OpenAI with the updated messages list.
+            # Here, we're basically asking OpenAI to answer our original question, but now it has the result of our function call to work with.
+            completion_2 = model_routing.create(
+                get_client(),
+                "answer",
+                model_routing.answer_model(),
+                messages=messages,
+                tools=tools,
+            )
+
+            print(completion_2.choices[0].message.content)
+
+    # Show how well the forecast cache did, so we can tell if it is big enough.
+    stats = get_cache().stats()
+    print(f"Forecast cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} entries")
+    if completion_cache.get_cache() is not None:
+        stats = completion_cache.get_cache().stats()
+        print(f"Completion cache: {stats['hits']} hits, {stats['misses']} misses, {stats['bytes_saved']} bytes saved")
+    # What each stage cost, so TOOL_MODEL / ANSWER_MODEL can be tuned.
+    for stage, stats in model_routing.stats().items():
+        escalated = f", {stats['escalation_rate']:.0%} escalated" if "escalation_rate" in stats else ""
+        print(f"{stage}: {stats['requests']} requests, {stats['mean_seconds'] * 1000:.0f} ms on average, "
+              f"${stats['cost']:.4f}{escalated}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ import os
 import json
 import openai
 from dotenv import load_dotenv
-import requests
+import http_transport
 
 
 # --------------------------------------------------------------
@@ -14,7 +14,7 @@ import requests
 # --------------------------------------------------------------
 
 def get_weather(latitude, longitude):
-    response = requests.get(f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,wind_speed_10m&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m")
+    response = http_transport.get(f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,wind_speed_10m&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m")
     data = response.json()
     return data['current']['temperature_2m']
 
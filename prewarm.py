@@ -0,0 +1,139 @@
+# --------------------------------------------------------------
+# Warm up the connections while the user is typing
+#  -    the scripts spend most of their time blocked on input(), and the
+#       network sits idle meanwhile. The OpenAI client drops a pooled
+#       connection after 5 seconds without a request, and Open-Meteo closes
+#       idle connections on its end, so the first requests of every turn pay
+#       for DNS, TCP and TLS all over again.
+#  -    while_waiting() goes around an input() call. Until it returns, a
+#       background thread resolves the OpenAI and Open-Meteo hosts and makes a
+#       cheap request to each (GET /models through the OpenAI client, a HEAD
+#       request through http_transport.py's Session), every PREWARM_INTERVAL
+#       seconds so the connections never sit idle long enough to be dropped.
+#       It gives up after PREWARM_MAX_SECONDS, in case nobody is typing. The
+#       first time, it also imports openai and creates the client.
+#  -    look_up(city) starts on the city as soon as it is typed in, while the
+#       next question is still being answered: the gazetteer lookup and the
+#       forecast for the place (from cache, or fetched), or if the gazetteer
+#       doesn't know the city, the speculative fetch (see speculation.py).
+#  -    turned on with PREWARM=1. It is off by default: the warm-up requests
+#       don't go through rate_limit.py, and up to one per PREWARM_INTERVAL is
+#       sent to each host while a prompt is up. How long each warm-up took is
+#       logged on the "prewarm" logger (set LOG_LEVEL=INFO to see it) and
+#       recorded in metrics.py. python -m benchmarks.bench_prewarm compares the first-byte
+#       latency of a turn with and without it.
+# --------------------------------------------------------------
+
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import forecast
+import gazetteer
+import http_transport
+import speculation
+from metrics import metrics
+from tool_executor import get_executor
+
+
+logger = logging.getLogger("prewarm")
+
+
+def enabled():
+    return os.getenv("PREWARM", "0").lower() in ("1", "true", "yes")
+
+
+def interval():
+    # Under the 5 seconds the OpenAI client keeps an idle connection.
+    return float(os.getenv("PREWARM_INTERVAL", "4"))
+
+
+def max_seconds():
+    return float(os.getenv("PREWARM_MAX_SECONDS", "60"))
+
+
+def resolve(url):
+    # Makes sure the host name resolves, and fills the system's DNS cache where there is one.
+    parts = urlsplit(url)
+    socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80),
+                       type=socket.SOCK_STREAM)
+
+
+def _warm_openai(client):
+    import openai
+
+    resolve(str(client.base_url))
+    try:
+        client.with_options(max_retries=0, timeout=http_transport.get_settings().read_timeout).models.list()
+    except openai.APIStatusError:
+        # Any answer at all (a 401, say) means the connection is open.
+        pass
+
+
+def _warm_forecast():
+    resolve(forecast.FORECAST_URL)
+    http_transport.warm(forecast.FORECAST_URL)
+
+
+def _timed(host, warm):
+    started = time.perf_counter()
+    try:
+        warm()
+        outcome = "ok"
+    except Exception as e:
+        # Nothing is waiting on a warm-up; the turn just connects on its own, as it would have anyway.
+        outcome = type(e).__name__
+    seconds = time.perf_counter() - started
+    metrics.observe("assistant_prewarm_seconds", seconds, host=host, outcome=outcome)
+    logger.info("warmed %s -> %s in %.0f ms", host, outcome, seconds * 1000)
+
+
+def warm(get_client=None, forecasts=True):
+    if get_client is not None:
+        _timed("openai", lambda: _warm_openai(get_client()))
+    if forecasts:
+        _timed("forecast", _warm_forecast)
+
+
+def _keep_warm(stop, get_client, forecasts):
+    deadline = time.monotonic() + max_seconds()
+    while True:
+        warm(get_client, forecasts)
+        if stop.wait(interval()) or time.monotonic() >= deadline:
+            return
+
+
+@contextmanager
+def while_waiting(get_client=None, forecasts=True):
+    # with prewarm.while_waiting(get_client): city = input(...)
+    # get_client is called on the background thread, so it has to be safe to call from two threads at once.
+    if not enabled():
+        yield
+        return
+    stop = threading.Event()
+    threading.Thread(target=_keep_warm, args=(stop, get_client, forecasts), name="prewarm", daemon=True).start()
+    try:
+        yield
+    finally:
+        stop.set()
+
+
+def _look_up(city):
+    place = gazetteer.resolve(city)
+    if place is None:
+        return None, speculation.start(city)
+    # The tool calls made for the place (see direct_tools.py) ask for exactly these coordinates.
+    get_executor().submit(forecast.get_current, place.latitude, place.longitude)
+    return place, None
+
+
+def look_up(city):
+    # Call after forecast.start_turn(). Returns a Future of (gazetteer place or None, Speculation or None),
+    # or None with PREWARM=0.
+    if not enabled():
+        return None
+    return get_executor().submit(_look_up, city)
@@ -0,0 +1,437 @@
+# --------------------------------------------------------------
+# Pacing for OpenAI completions
+#  -    OpenAI limits how many requests and how many tokens we may use per
+#       minute. One person at a keyboard never gets near that, but batch mode
+#       and the HTTP service do, and then every request that gets a 429 is
+#       retried right away, gets another 429, and throughput collapses.
+#  -    every completion goes through create() / acreate() below (completion_cache.py
+#       and streaming.py call them). Before a request is sent, the scheduler:
+#           waits for a free slot: at most `concurrency` requests are in flight
+#               (a streamed response keeps its slot until it has been read to
+#               the end, or closed)
+#           takes one request and the estimated tokens (prompt size / 4 plus
+#               the completion) from two token buckets, and waits if they are
+#               empty
+#  -    the buckets and the concurrency follow what OpenAI tells us in every
+#       response: x-ratelimit-limit-* sets the bucket sizes (so with no
+#       RATE_LIMIT_RPM / RATE_LIMIT_TPM set, the limits are learnt from the
+#       first response), x-ratelimit-remaining-* empties them further if
+#       OpenAI counted more than we did. Concurrency grows by one after each
+#       success, shrinks when little is left, and is halved on a 429.
+#  -    429s, 5xx errors and dropped connections are retried up to
+#       RATE_LIMIT_RETRIES times, with exponential backoff plus jitter, and
+#       never sooner than retry-after says. A 429 pauses every request, not
+#       just the one that got it.
+#  -    two lanes: interactive (the default) and batch. Waiting interactive
+#       requests always get the next free slot, and batch requests never take
+#       the last one. Batch mode sets current_lane to "batch".
+#  -    benchmarks/bench_rate_limit.py runs it against the stand-in server with
+#       limits switched on.
+# --------------------------------------------------------------
+
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+from message_records import compact
+from metrics import metrics
+
+
+# Lower numbers go first.
+LANES = {"interactive": 0, "batch": 1}
+
+current_lane = contextvars.ContextVar("current_lane", default="interactive")
+
+# What we assume an answer will use when the request doesn't set max_tokens.
+# Corrected with the real usage once the response is in.
+COMPLETION_TOKENS = 256
+
+
+class TokenBucket:
+    # Holds up to per_minute tokens and refills at per_minute a minute. With
+    # per_minute=None there is no limit (until update() says otherwise).
+    def __init__(self, per_minute=None):
+        self.per_minute = per_minute
+        self.level = per_minute or 0.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        # Takes amount tokens, going into debt if there aren't enough, and returns
+        # how many seconds to wait before using them.
+        with self._lock:
+            if not self.per_minute:
+                return 0.0
+            self._refill()
+            self.level -= amount
+            return max(0.0, -self.level * 60 / self.per_minute)
+
+    def refund(self, amount):
+        # Gives back tokens reserved but not used (or takes more, if amount is negative).
+        with self._lock:
+            if self.per_minute:
+                self._refill()
+                self.level = min(self.per_minute, self.level + amount)
+
+    def update(self, limit=None, remaining=None):
+        # What OpenAI says about this limit in its response headers.
+        with self._lock:
+            self._refill()
+            if limit:
+                if not self.per_minute:
+                    self.level = limit
+                self.per_minute = limit
+            if remaining is not None and self.per_minute:
+                self.level = min(self.level, remaining)
+
+    # Callers must hold self._lock.
+    def _refill(self):
+        now = time.monotonic()
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(headers):
+    # Seconds to wait, from retry-after-ms or retry-after (seconds), or None.
+    milliseconds = _number(headers.get("retry-after-ms"))
+    if milliseconds is not None:
+        return milliseconds / 1000
+    return _number(headers.get("retry-after"))
+
+
+def estimate_tokens(kwargs):
+    # About 4 characters per token for the prompt, plus what the answer may use.
+    chars = 0
+    for message in kwargs.get("messages") or []:
+        message = compact(message)
+        chars += len(message.content or "")
+        chars += sum(len(tool_call.arguments or "") for tool_call in message.tool_calls or ())
+    if kwargs.get("tools"):
+        chars += len(json.dumps(kwargs["tools"]))
+    return chars // 4 + (kwargs.get("max_completion_tokens") or kwargs.get("max_tokens") or COMPLETION_TOKENS)
+
+
+class Scheduler:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=64,
+                 retries=5, backoff=0.5, max_backoff=30.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        # Requests waiting for a slot: [priority, order, wake, granted], best first. wake
+        # is set to None for a waiter that gave up.
+        self._waiters = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def call(self, request, estimate, stage=None, hold=False):
+        # Runs request() (which returns a raw response with .headers) when the limits allow it.
+        # With hold=True a successful request keeps its slot, and the caller hands it back with _release().
+        priority = LANES[current_lane.get()]
+        for attempt in itertools.count():
+            self._acquire(priority)
+            held = False
+            try:
+                time.sleep(self._wait(estimate, stage))
+                response = request()
+            except Exception as e:
+                wait = self._failed(e, stage)
+                if wait is None or attempt >= self.retries:
+                    raise
+            else:
+                self._succeeded(response.headers)
+                held = hold
+                return response
+            finally:
+                if not held:
+                    self._release()
+            time.sleep(self._backoff(attempt, wait))
+
+    async def acall(self, request, estimate, stage=None, hold=False):
+        # The same for coroutines: request() returns an awaitable.
+        import asyncio
+
+        priority = LANES[current_lane.get()]
+        for attempt in itertools.count():
+            await self._aacquire(priority)
+            held = False
+            try:
+                await asyncio.sleep(self._wait(estimate, stage))
+                response = await request()
+            except Exception as e:
+                wait = self._failed(e, stage)
+                if wait is None or attempt >= self.retries:
+                    raise
+            else:
+                self._succeeded(response.headers)
+                held = hold
+                return response
+            finally:
+                if not held:
+                    self._release()
+            await asyncio.sleep(self._backoff(attempt, wait))
+
+    # --------------------------------------------------------------
+    # Slots
+    # --------------------------------------------------------------
+
+    def _acquire(self, priority):
+        event = threading.Event()
+        waiter = self._enqueue(priority, event.set)
+        if waiter is not None:
+            event.wait()
+
+    async def _aacquire(self, priority):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Slots can be handed over from any thread, so the future is only touched on its own loop.
+        waiter = self._enqueue(priority, lambda: loop.call_soon_threadsafe(_resolve, future))
+        if waiter is None:
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter[3]
+                waiter[2] = None
+            # _wake() may have handed us the slot just as we were cancelled; pass it on.
+            if granted:
+                self._release()
+            raise
+
+    def _enqueue(self, priority, wake):
+        # Takes a slot straight away and returns None, or queues a waiter that wake() is called for.
+        with self._lock:
+            if not self._waiters and self._free(priority):
+                self.in_flight += 1
+                return None
+            waiter = [priority, next(self._order), wake, False]
+            heapq.heappush(self._waiters, waiter)
+            return waiter
+
+    def _free(self, priority):
+        # Callers must hold self._lock. Batch requests leave the last slot for interactive ones.
+        reserved = 1 if priority > LANES["interactive"] and self.concurrency > 1 else 0
+        return self.in_flight + reserved < self.concurrency
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    # Callers must hold self._lock.
+    def _wake(self):
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter[2] is None:
+                heapq.heappop(self._waiters)
+                continue
+            if not self._free(waiter[0]):
+                return
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            waiter[3] = True
+            waiter[2]()
+
+    # --------------------------------------------------------------
+    # Pacing and adapting to OpenAI's answers
+    # --------------------------------------------------------------
+
+    def _wait(self, estimate, stage):
+        # Seconds to wait before sending: the token buckets and any pause after a 429.
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimate), self.paused_until - time.monotonic())
+        if wait > 0:
+            metrics.observe("assistant_rate_limit_wait_seconds", wait, stage=stage or "completion")
+        return max(0.0, wait)
+
+    def _succeeded(self, headers):
+        limits = []
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            limit = _number(headers.get(f"x-ratelimit-limit-{kind}"))
+            remaining = _number(headers.get(f"x-ratelimit-remaining-{kind}"))
+            bucket.update(limit, remaining)
+            limits.append((limit or bucket.per_minute, remaining))
+        with self._lock:
+            if any(limit and remaining is not None and remaining < limit * 0.1 for limit, remaining in limits):
+                self.concurrency = max(1, self.concurrency - 1)
+            elif self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._wake()
+
+    def _failed(self, error, stage):
+        # Returns the least number of seconds to wait before trying again, or None if
+        # the error isn't worth retrying.
+        import openai
+
+        if isinstance(error, openai.APIStatusError):
+            status = error.status_code
+            if status != 429 and status < 500:
+                return None
+            wait = retry_after(error.response.headers) or 0.0
+            if status == 429:
+                with self._lock:
+                    self.throttled += 1
+                    # Requests sent before the pause all get their 429 at about the same time;
+                    # only the first of them halves the concurrency.
+                    now = time.monotonic()
+                    if now >= self.paused_until:
+                        self.concurrency = max(1, self.concurrency // 2)
+                    self.paused_until = max(self.paused_until, now + wait)
+            reason = "rate_limited" if status == 429 else "server_error"
+        elif isinstance(error, openai.APIConnectionError):
+            wait, reason = 0.0, "connection"
+        else:
+            return None
+        metrics.inc("assistant_retries_total", stage=stage or "completion", reason=reason)
+        metrics.trace("retry", stage=stage or "completion", reason=reason, retry_after=wait)
+        return wait
+
+    def _backoff(self, attempt, wait):
+        # Exponential backoff with jitter (half of it random), but never less than retry-after.
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return max(wait, delay / 2 + random.uniform(0, delay / 2))
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Built on first use, so the RATE_LIMIT_* settings can come from the .env file.
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(
+                requests_per_minute=_number(os.getenv("RATE_LIMIT_RPM")),
+                tokens_per_minute=_number(os.getenv("RATE_LIMIT_TPM")),
+                max_concurrency=int(os.getenv("RATE_LIMIT_CONCURRENCY", "64")),
+                retries=int(os.getenv("RATE_LIMIT_RETRIES", "5")),
+                backoff=float(os.getenv("RATE_LIMIT_BACKOFF", "0.5")),
+                max_backoff=float(os.getenv("RATE_LIMIT_MAX_BACKOFF", "30")),
+            )
+    return _scheduler
+
+
+# The scheduler does the retrying, so the OpenAI library's own retries are switched off.
+_without_retries = weakref.WeakKeyDictionary()
+
+
+def _completions(client):
+    if client not in _without_retries:
+        _without_retries[client] = client.with_options(max_retries=0)
+    return _without_retries[client].chat.completions.with_raw_response
+
+
+def create(client, stage=None, **kwargs):
+    # client.chat.completions.create(**kwargs), paced and retried by the scheduler.
+    scheduler = get_scheduler()
+    estimate = estimate_tokens(kwargs)
+    stream = bool(kwargs.get("stream"))
+    response = scheduler.call(lambda: _completions(client).create(**kwargs), estimate, stage, hold=stream)
+    if not stream:
+        return _parse(scheduler, response, estimate)
+    try:
+        return _Stream(_parse(scheduler, response, estimate), scheduler._release)
+    except BaseException:
+        scheduler._release()
+        raise
+
+
+async def acreate(client, stage=None, **kwargs):
+    # The same for AsyncOpenAI clients.
+    scheduler = get_scheduler()
+    estimate = estimate_tokens(kwargs)
+    stream = bool(kwargs.get("stream"))
+    response = await scheduler.acall(lambda: _completions(client).create(**kwargs), estimate, stage, hold=stream)
+    if not stream:
+        return _parse(scheduler, response, estimate)
+    try:
+        return _AsyncStream(_parse(scheduler, response, estimate), scheduler._release)
+    except BaseException:
+        scheduler._release()
+        raise
+
+
+class _Stream:
+    # A streamed response, which gives its slot back once it has been read to the end or closed.
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self.close()
+
+    def close(self):
+        release, self._release = self._release, None
+        try:
+            self._stream.close()
+        finally:
+            if release is not None:
+                release()
+
+
+class _AsyncStream:
+    # The same for AsyncOpenAI streams.
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            await self.close()
+
+    async def close(self):
+        release, self._release = self._release, None
+        try:
+            await self._stream.close()
+        finally:
+            if release is not None:
+                release()
+
+
+def _parse(scheduler, response, estimate):
+    result = response.parse()
+    # A streamed response's usage only comes at the end; the headers have to do for those.
+    usage = getattr(result, "usage", None)
+    if usage is not None:
+        scheduler.tokens.refund(estimate - usage.total_tokens)
+    return result
@@ -0,0 +1,131 @@
+# --------------------------------------------------------------
+# Fetch the forecast while OpenAI is still picking the tools
+#  -    when the gazetteer can't settle a city by itself (it is ambiguous, or
+#       not in the list), openai_function_calling.py asks OpenAI for the tool
+#       calls first and only then fetches the forecast, one after the other.
+#       But we can usually guess where the model will point: the biggest place
+#       with that name, or the coordinates the model gave the last time
+#       someone asked about the same city.
+#  -    start() fetches the forecast for that guess on the tool thread pool
+#       (see tool_executor.py) while the completion is running. Once the tool
+#       calls are in, use() hands the fetch to every tool call whose
+#       coordinates are within SPECULATE_TOLERANCE degrees of the guess; if
+#       none are, the fetch is thrown away and the tools fetch as usual.
+#  -    streaming.stream_tool_calls() hands over the tool calls one at a time,
+#       so adopt() and finish() are the two halves of use(): adopt() for each
+#       tool call as it comes in, finish() once they are all in.
+#  -    use() also remembers the model's coordinates for the city (the last
+#       SPECULATE_CACHE_SIZE cities), so the next question about it can be
+#       guessed even if the gazetteer has never heard of it.
+#  -    turned off with SPECULATE=0. How often the guess was used is logged on
+#       the "speculation" logger (set LOG_LEVEL=INFO to see it) and counted in
+#       metrics.py as cache="speculation" lookups.
+# --------------------------------------------------------------
+
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import forecast
+import gazetteer
+from metrics import metrics
+
+
+logger = logging.getLogger("speculation")
+
+Speculation = namedtuple("Speculation", ["point", "future"])
+
+# normalized city name -> (latitude, longitude) the model used for it, least recently used first
+_resolved = OrderedDict()
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+
+def enabled():
+    return os.getenv("SPECULATE", "1").lower() not in ("0", "false", "no")
+
+
+def tolerance():
+    # About 11 km; Open-Meteo's grid is coarser than the difference between two guesses at a city center.
+    return float(os.getenv("SPECULATE_TOLERANCE", "0.1"))
+
+
+def guess(city):
+    # The coordinates the model will most likely use for city, or None.
+    key = gazetteer.normalize(city)
+    with _lock:
+        if key in _resolved:
+            _resolved.move_to_end(key)
+            return _resolved[key]
+    candidates = gazetteer.candidates(city)
+    if candidates:
+        return (candidates[0].latitude, candidates[0].longitude)
+    return None
+
+
+def learn(city, points):
+    # Only questions about one place tell us where the city is.
+    if len(set(points)) != 1:
+        return
+    with _lock:
+        _resolved[gazetteer.normalize(city)] = points[0]
+        _resolved.move_to_end(gazetteer.normalize(city))
+        while len(_resolved) > int(os.getenv("SPECULATE_CACHE_SIZE", "1024")):
+            _resolved.popitem(last=False)
+
+
+def start(city):
+    # Call after forecast.start_turn(). Returns a Speculation, or None if there is nothing to guess.
+    if not enabled():
+        return None
+    point = guess(city)
+    if point is None:
+        return None
+    # Claimed for the turn right away: a task that only started fetching later could find its own
+    # future already adopted for the point, and wait on itself.
+    return Speculation(point, forecast.start_prefetch([point])[point])
+
+
+def adopt(speculation, tool_calls):
+    # Hands the speculative fetch to the tool calls close to the guess. Returns whether any were.
+    if speculation is None:
+        return False
+    latitude, longitude = speculation.point
+    close = [point for point in forecast.tool_call_points(tool_calls)
+             if abs(point[0] - latitude) <= tolerance() and abs(point[1] - longitude) <= tolerance()]
+    # A guess that has already failed is no better than fetching again.
+    if not close or (speculation.future.done() and speculation.future.exception() is not None):
+        return False
+    for point in close:
+        forecast.adopt(point, speculation.future)
+    return True
+
+
+def finish(speculation, city, tool_calls, used):
+    # Call once all the tool calls are in; used says whether adopt() ever returned True.
+    global hits, misses
+    learn(city, forecast.tool_call_points(tool_calls))
+    if speculation is None:
+        return
+
+    metrics.inc("assistant_cache_lookups_total", cache="speculation", result="hit" if used else "miss")
+    with _lock:
+        if used:
+            hits += 1
+        else:
+            misses += 1
+        total = hits + misses
+        logger.info("speculative forecast %s; used for %d of %d turns (%.0f%%)",
+                    "used" if used else "thrown away", hits, total, 100 * hits / total)
+
+
+def use(speculation, city, tool_calls):
+    finish(speculation, city, tool_calls, adopt(speculation, tool_calls))
+
+
+def stats():
+    with _lock:
+        total = hits + misses
+        return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
@@ -0,0 +1,203 @@
+# --------------------------------------------------------------
+# Print an answer as it is being written
+#  -    without stream=True, OpenAI sends the whole answer back at once, so
+#       nothing shows up on screen until the very last word is ready.
+#       stream_completion() asks for the answer in small chunks instead and
+#       prints each one as soon as it arrives.
+#  -    it still puts the whole answer back together, so it can be added to
+#       the conversation just like a normal response, and it records how long
+#       the first token and the full answer took. It also asks OpenAI to
+#       report token usage at the end of the stream, like a normal response does.
+#  -    pass stage=... to go through the completion cache (see
+#       completion_cache.py): a cached answer is printed in one go.
+#  -    astream_completion() does the same with an AsyncOpenAI client, handing
+#       each piece of text to a callback instead of printing it.
+#  -    stream_tool_calls() streams the tool selection request instead: each
+#       tool call is handed to a callback as soon as its arguments are a whole
+#       JSON object, so it can start while the model is still writing the next
+#       one. The message it puts back together is the same as the one a normal
+#       response gives (after compact(), see message_records.py).
+# --------------------------------------------------------------
+
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+
+import completion_cache
+import rate_limit
+from message_records import Message, ToolCall
+from metrics import metrics
+
+
+StreamResult = namedtuple("StreamResult", ["content", "time_to_first_token", "total_time", "usage"], defaults=[None])
+
+
+def streaming_enabled():
+    # Set STREAM_RESPONSES=0 in .env to go back to waiting for the whole answer.
+    return os.getenv("STREAM_RESPONSES", "1").lower() not in ("0", "false", "no")
+
+
+def stream_completion(client, out=sys.stdout, stage=None, **kwargs):
+    started = time.perf_counter()
+    time_to_first_token = None
+    parts = []
+
+    cached, key = completion_cache.lookup(stage, **kwargs) if stage else (None, None)
+    if cached is not None:
+        content = cached.choices[0].message.content or ""
+        out.write(content + "\n")
+        elapsed = time.perf_counter() - started
+        return StreamResult(content, elapsed, elapsed)
+
+    usage = None
+    with metrics.timer("assistant_completion_seconds", stage or "completion"):
+        stream = rate_limit.create(client, stage, stream=True, stream_options={"include_usage": True}, **kwargs)
+        for chunk in stream:
+            # The usage comes in one last chunk that has no choices.
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                parts.append(text)
+                out.write(text)
+                out.flush()
+    out.write("\n")
+    metrics.record_usage(stage or "completion", usage)
+
+    content = "".join(parts)
+    completion_cache.store(stage, key, completion_cache.answer_completion(kwargs.get("model"), content))
+    return StreamResult(content, time_to_first_token, time.perf_counter() - started, usage)
+
+
+async def astream_completion(client, on_text, stage=None, **kwargs):
+    started = time.perf_counter()
+    time_to_first_token = None
+    parts = []
+
+    cached, key = completion_cache.lookup(stage, **kwargs) if stage else (None, None)
+    if cached is not None:
+        content = cached.choices[0].message.content or ""
+        on_text(content)
+        elapsed = time.perf_counter() - started
+        return StreamResult(content, elapsed, elapsed)
+
+    usage = None
+    with metrics.timer("assistant_completion_seconds", stage or "completion"):
+        stream = await rate_limit.acreate(client, stage, stream=True, stream_options={"include_usage": True}, **kwargs)
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                parts.append(text)
+                on_text(text)
+    metrics.record_usage(stage or "completion", usage)
+
+    content = "".join(parts)
+    completion_cache.store(stage, key, completion_cache.answer_completion(kwargs.get("model"), content))
+    return StreamResult(content, time_to_first_token, time.perf_counter() - started, usage)
+
+
+def stream_tool_calls_enabled():
+    # Set STREAM_TOOL_CALLS=1 in .env to start each tool call while the model is still picking the others.
+    return os.getenv("STREAM_TOOL_CALLS", "0").lower() in ("1", "true", "yes")
+
+
+def _complete(arguments):
+    # The model writes the arguments as one JSON object, so it can only be complete once it ends in "}".
+    if not arguments.rstrip().endswith("}"):
+        return False
+    try:
+        json.loads(arguments)
+    except ValueError:
+        return False
+    return True
+
+
+def stream_tool_calls(client, on_tool_call, stage=None, **kwargs):
+    # Calls on_tool_call(index, tool_call) once for every tool call, in the order they are finished.
+    # Returns (assistant message, tool calls, usage), the tool calls in the order the model wrote them.
+    cached, key = completion_cache.lookup(stage, **kwargs) if stage else (None, None)
+    if cached is not None:
+        message = cached.choices[0].message
+        tool_calls = message.tool_calls or []
+        for index, tool_call in enumerate(tool_calls):
+            on_tool_call(index, tool_call)
+        return Message("assistant", message.content, [ToolCall(call.id, call.function.name, call.function.arguments)
+                                                      for call in tool_calls]), tool_calls, None
+
+    parts = []
+    calls = {}  # index -> tool call, as far as it has been written
+    arguments = {}  # index -> list of argument pieces
+    done = set()
+
+    def finish(index):
+        if index in done:
+            return
+        done.add(index)
+        calls[index].function.arguments = "".join(arguments[index])
+        on_tool_call(index, calls[index])
+
+    usage = None
+    with metrics.timer("assistant_completion_seconds", stage or "completion"):
+        stream = rate_limit.create(client, stage, stream=True, stream_options={"include_usage": True}, **kwargs)
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                parts.append(delta.content)
+            for piece in delta.tool_calls or ():
+                if piece.index not in calls:
+                    # The model writes one tool call after the other, so a new one means the others are done,
+                    # even if their arguments didn't parse (the tool call then reports the error).
+                    for index in calls:
+                        finish(index)
+                    calls[piece.index] = SimpleNamespace(
+                        id=None, type="function", function=SimpleNamespace(name="", arguments=""))
+                    arguments[piece.index] = []
+                call = calls[piece.index]
+                if piece.id:
+                    call.id = piece.id
+                if piece.function is not None:
+                    call.function.name += piece.function.name or ""
+                    if piece.function.arguments:
+                        arguments[piece.index].append(piece.function.arguments)
+                        if piece.index not in done and _complete("".join(arguments[piece.index])):
+                            finish(piece.index)
+        for index in calls:
+            finish(index)
+    metrics.record_usage(stage or "completion", usage)
+
+    tool_calls = [calls[index] for index in sorted(calls)]
+    # Anything written after the closing "}" (whitespace, usually) still belongs in the history.
+    message = Message("assistant", "".join(parts) or None,
+                      [ToolCall(calls[index].id, calls[index].function.name, "".join(arguments[index]))
+                       for index in sorted(calls)])
+    completion_cache.store(stage, key, completion_cache.answer_completion(kwargs.get("model"), message.content,
+                                                                          message.tool_calls))
+    return message, tool_calls, usage
+
+
+def as_message(result):
+    # The assistant message to add to the conversation history.
+    return Message("assistant", result.content)
+
+
+def format_timing(result):
+    if result.time_to_first_token is None:
+        return f"(no text received, done after {result.total_time:.2f}s)"
+    return f"(first token after {result.time_to_first_token:.2f}s, done after {result.total_time:.2f}s)"
@@ -0,0 +1,93 @@
+# --------------------------------------------------------------
+# Run a turn's tool calls at the same time
+#  -    when OpenAI asks for several tool calls (say, weather and wind for three
+#       cities), running them one after another means waiting on every network
+#       call in turn. run_tool_calls() hands them to a thread pool instead.
+#  -    the "tool" messages still come back in the same order as the tool calls,
+#       and a call that fails or takes too long turns into an error message for
+#       that call rather than crashing the whole turn.
+#  -    submit() and collect() are the two halves of run_tool_calls(), for
+#       callers that start each call as soon as they know about it (see
+#       streaming.stream_tool_calls()).
+# --------------------------------------------------------------
+
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from message_records import tool_result
+from metrics import metrics
+
+
+# Tool messages for calls that failed start with this, so later steps can tell them apart.
+ERROR_PREFIX = "Error: "
+
+
+def is_error(message):
+    return message["content"].startswith(ERROR_PREFIX)
+
+
+class _TurnExecutor(ThreadPoolExecutor):
+    # Runs everything in a copy of the submitting thread's context, so a tool call sees
+    # the forecasts of the turn that started it (see forecast.start_turn()).
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# One pool is shared by every turn. It is created on first use so the
+# TOOL_MAX_WORKERS setting can come from the .env file loaded by the scripts.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = _TurnExecutor(
+                max_workers=int(os.getenv("TOOL_MAX_WORKERS", "8")),
+                thread_name_prefix="tool-call",
+            )
+    return _executor
+
+
+def _call(call_function, tool_call):
+    name = tool_call.function.name
+    with metrics.timer("assistant_tool_seconds", "tool", tool=name):
+        args = json.loads(tool_call.function.arguments)
+        return call_function(name, args)
+
+
+def submit(tool_call, call_function):
+    # Starts one tool call on the pool; collect() turns the futures into tool messages.
+    return get_executor().submit(_call, call_function, tool_call)
+
+
+def run_tool_calls(tool_calls, call_function, timeout=None):
+    return collect(tool_calls, [submit(tool_call, call_function) for tool_call in tool_calls], timeout)
+
+
+def collect(tool_calls, futures, timeout=None):
+    if timeout is None:
+        timeout = float(os.getenv("TOOL_TIMEOUT", "10"))
+
+    # Collect results in the original order. Every call gets at least `timeout`
+    # seconds, counted from when we start waiting on it.
+    messages = []
+    for tool_call, future in zip(tool_calls, futures):
+        name = tool_call.function.name
+        try:
+            content = str(future.result(timeout=timeout))
+        except TimeoutError:
+            # A call that has not started yet can still be dropped; one that is
+            # already running is left to finish on its own.
+            future.cancel()
+            metrics.inc("assistant_errors_total", stage="tool")
+            content = f"{ERROR_PREFIX}{name} did not finish within {timeout:g} seconds."
+        except Exception as e:
+            content = f"{ERROR_PREFIX}{name} failed: {e}"
+
+        messages.append(tool_result(tool_call.id, content))
+    return messages
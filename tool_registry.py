@@ -0,0 +1,136 @@
+# --------------------------------------------------------------
+# Tool registry
+#  -    instead of writing each tool's JSON schema by hand and then adding
+#       another "if name == ..." to call_function, put @registry.tool(...) on
+#       a plain Python function:
+#
+#           registry = ToolRegistry()
+#
+#           @registry.tool("Get current temperature for provided coordinates in celsius.")
+#           def get_weather(latitude: float, longitude: float):
+#               ...
+#
+#       The strict JSON schema is generated from the function's signature and
+#       type hints, and registry.call(name, args) finds the function in a dict.
+#  -    everything that can be worked out ahead of time is: the schema list
+#       (registry.tools) is built once, and each tool gets an argument checker
+#       when it is registered. Arguments from the model are checked before the
+#       function is called, so a bad tool call becomes a clear ToolArgumentError instead of a TypeError
+#       somewhere inside the tool.
+# --------------------------------------------------------------
+
+import inspect
+import typing
+
+
+class ToolArgumentError(ValueError):
+    pass
+
+
+# Python type -> (JSON schema type, the Python types we accept for it)
+JSON_TYPES = {
+    float: ("number", (int, float)),
+    int: ("integer", (int,)),
+    str: ("string", (str,)),
+    bool: ("boolean", (bool,)),
+}
+
+
+def _parameter_schema(name, annotation):
+    if typing.get_origin(annotation) is typing.Literal:
+        choices = typing.get_args(annotation)
+        return {"enum": list(choices)}, lambda value: value in choices
+    if annotation not in JSON_TYPES:
+        raise TypeError(f"parameter {name!r} needs a float, int, str, bool or Literal type hint, not {annotation!r}")
+
+    json_type, accepted = JSON_TYPES[annotation]
+    if annotation is bool:
+        return {"type": json_type}, lambda value: isinstance(value, bool)
+    # bool is a subclass of int, but True is not a number as far as the schema is concerned.
+    return {"type": json_type}, lambda value: isinstance(value, accepted) and not isinstance(value, bool)
+
+
+class Tool:
+    def __init__(self, function, description):
+        self.function = function
+        self.name = function.__name__
+
+        hints = typing.get_type_hints(function)
+        properties = {}
+        self._checks = {}
+        for name in inspect.signature(function).parameters:
+            properties[name], self._checks[name] = _parameter_schema(name, hints.get(name))
+
+        self.schema = {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": description or inspect.getdoc(function) or "",
+                "parameters": {
+                    "type": "object",
+                    "properties": properties,
+                    # Strict mode wants every parameter listed as required.
+                    "required": list(properties),
+                    "additionalProperties": False
+                },
+                "strict": True
+            }
+        }
+
+    def validate(self, args):
+        if not isinstance(args, dict):
+            raise ToolArgumentError(f"{self.name} expects an object of arguments, got {type(args).__name__}")
+        missing = self._checks.keys() - args.keys()
+        if missing:
+            raise ToolArgumentError(f"{self.name} is missing argument(s): {', '.join(sorted(missing))}")
+        extra = args.keys() - self._checks.keys()
+        if extra:
+            raise ToolArgumentError(f"{self.name} got unexpected argument(s): {', '.join(sorted(extra))}")
+        for name, check in self._checks.items():
+            if not check(args[name]):
+                raise ToolArgumentError(f"{self.name} got a bad value for {name}: {args[name]!r}")
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._tools = {}
+        self._schemas = None
+
+    def tool(self, description=None):
+        def register(function):
+            tool = Tool(function, description)
+            if tool.name in self._tools:
+                raise ValueError(f"a tool called {tool.name!r} is already registered")
+            self._tools[tool.name] = tool
+            # A new tool means the schema list is out of date.
+            self._schemas = None
+            return function
+        return register
+
+    def __contains__(self, name):
+        return name in self._tools
+
+    def __len__(self):
+        return len(self._tools)
+
+    def get(self, name):
+        return self._tools.get(name)
+
+    @property
+    def names(self):
+        return list(self._tools)
+
+    @property
+    def tools(self):
+        # The list to pass as tools=... to chat.completions.create().
+        if self._schemas is None:
+            self._schemas = [tool.schema for tool in self._tools.values()]
+        return self._schemas
+
+    def call(self, name, args):
+        tool = self._tools.get(name)
+        if tool is None:
+            raise ToolArgumentError(f"there is no tool called {name!r}")
+        tool.validate(args)
+        # For async tools this returns a coroutine for the caller to await.
+        return tool.function(**args)